@@ -0,0 +1,232 @@
+# pytransport.Cache - on-disk cache of data read from Transport output files.
+# Version 1.0
+# W. Shields and J. Snuverink
+# william.shields.2010@live.rhul.ac.uk
+
+"""
+Cache
+
+An on-disk cache of the optics, lattice and fits read from Transport output files,
+so that reading an unchanged file again does not re-run the text parser.
+
+>>> cache = pytransport.Cache.OutputCache('transportcache', maxSize=500e6)
+>>> r = pytransport.Reader.Reader(cache=cache)
+>>> optics = r.GetOptics('FOR002.DAT')  # parsed and stored
+>>> optics = r.GetOptics('FOR002.DAT')  # loaded from the cache
+
+Classes:
+OutputCache - a size bounded directory of parsed output files.
+
+"""
+
+import glob as _glob
+import hashlib as _hashlib
+import numpy as _np
+import os as _os
+import tempfile as _tempfile
+import zipfile as _zipfile
+
+from Data import BDSData as _BDA
+
+# Increase when the stored format or the parsed results change so old entries are not used.
+_cacheVersion = 1
+
+
+class OutputCache:
+    """
+    A directory of parsed Transport output files stored as numpy .npz files.
+
+    Entries are keyed by the absolute file path, size and modification time of the output
+    file, and by the function and arguments used to read it. If useHash is True the SHA-1
+    of the file contents is also used, so a file rewritten with the same size and time
+    is not mistaken for the original.
+
+    When the total size of the entries exceeds maxSize (bytes) the least recently used
+    entries are removed.
+
+    directory: string, directory for the cache files. Created if it does not exist.
+    maxSize: float, default = 1e9. Maximum total size of the cache in bytes.
+    useHash: bool, default = False. Include a hash of the file contents in the key.
+    """
+    def __init__(self, directory, maxSize=1e9, useHash=False):
+        self.directory = _os.path.abspath(_os.path.expanduser(directory))
+        self.maxSize = maxSize
+        self.useHash = useHash
+        if not _os.path.isdir(self.directory):
+            _os.makedirs(self.directory)
+
+    def Fetch(self, inputFile, name, args, function):
+        """
+        Return the result stored for inputFile, name and args, or call function(), store
+        its result and return it if there is none.
+        """
+        entry = self._entryPath(inputFile, name, args)
+        try:
+            result = _Decode(entry)
+            _os.utime(entry, None)  # mark as recently used
+            return result
+        except (IOError, OSError, ValueError, KeyError, _zipfile.BadZipfile):
+            pass
+        result = function()
+        self._store(entry, result)
+        return result
+
+    def Invalidate(self, inputFile):
+        """
+        Remove all entries for inputFile.
+        """
+        for entry in _glob.glob(_os.path.join(self.directory, _pathKey(inputFile) + '_*.npz')):
+            _remove(entry)
+
+    def Clear(self):
+        """
+        Remove all entries.
+        """
+        for entry in _glob.glob(_os.path.join(self.directory, '*.npz')):
+            _remove(entry)
+
+    def Size(self):
+        """
+        Total size of the entries in bytes.
+        """
+        return sum(size for _, size, _ in self._entries())
+
+    def _entryPath(self, inputFile, name, args):
+        try:
+            stat = _os.stat(inputFile)
+        except OSError as e:  # as when the file is opened without a cache
+            raise IOError(e.errno, e.strerror, inputFile)
+        key = [_cacheVersion, _os.path.abspath(inputFile), stat.st_size, stat.st_mtime, name, args]
+        if self.useHash:
+            key.append(_FileHash(inputFile))
+        filename = _pathKey(inputFile) + '_' + _hashlib.sha1(repr(key)).hexdigest() + '.npz'
+        return _os.path.join(self.directory, filename)
+
+    def _store(self, entry, result):
+        # write to a temporary file and rename so a concurrent reader never sees a partial entry
+        fd, tmpname = _tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with _os.fdopen(fd, 'wb') as tmpfile:
+                _np.savez(tmpfile, **_Encode(result))
+            _os.rename(tmpname, entry)
+        except:
+            _remove(tmpname)
+            raise
+        self._evict()
+
+    def _entries(self):
+        entries = []
+        for entry in _glob.glob(_os.path.join(self.directory, '*.npz')):
+            try:
+                stat = _os.stat(entry)
+            except OSError:
+                continue  # removed by another process
+            entries.append((entry, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _evict(self):
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for entry, size, _ in sorted(entries, key=lambda e: e[2]):
+            if total <= self.maxSize:
+                break
+            _remove(entry)
+            total -= size
+
+
+def _FileHash(inputFile, chunkSize=1 << 20):
+    """
+    SHA-1 of the contents of inputFile, read in chunks.
+    """
+    sha = _hashlib.sha1()
+    with open(inputFile, 'rb') as infile:
+        chunk = infile.read(chunkSize)
+        while chunk:
+            sha.update(chunk)
+            chunk = infile.read(chunkSize)
+    return sha.hexdigest()
+
+
+def _pathKey(inputFile):
+    return _hashlib.sha1(_os.path.abspath(inputFile)).hexdigest()[:16]
+
+
+def _remove(filename):
+    try:
+        _os.remove(filename)
+    except OSError:
+        pass
+
+
+def _Encode(result):
+    """
+    Convert a result of the Reader into a dict of arrays for numpy.savez.
+    Handles BDSData, numpy arrays, lists of lines, (fits, fitres) tuples, (optics, matrices)
+    tuples and None.
+    """
+    if isinstance(result, tuple) and isinstance(result[1], dict):
+        optics, matrices = result
+        arrays = _Encode(optics)
+        arrays['opticsKind'] = arrays['kind']
+        arrays['kind'] = _np.array('matrices')
+        arrays['matrixNames'] = _np.array(sorted(matrices), dtype=_np.str)
+        for name in matrices:
+            arrays['matrix_' + name] = matrices[name]
+        return arrays
+    elif result is None:
+        return {'kind': _np.array('none')}
+    elif isinstance(result, _BDA):
+        arrays = {'kind': _np.array('bdsdata'),
+                  'names': _np.array(result.names, dtype=_np.str),
+                  'units': _np.array(result.units, dtype=_np.str)}
+        for index, name in enumerate(result.names):
+            arrays['column' + _np.str(index)] = _np.array(result.GetColumn(name))
+        if hasattr(result, 'errors'):
+            arrays['errors'] = _np.array(result.errors, dtype=_np.str)
+        return arrays
+    elif isinstance(result, _np.ndarray):
+        return {'kind': _np.array('array'), 'data': result}
+    elif isinstance(result, tuple):
+        fits, fitres = result
+        return {'kind': _np.array('fits'),
+                'fits': _np.array(fits, dtype=_np.str),
+                'fitres': _np.array(fitres, dtype=_np.str)}
+    elif isinstance(result, list):
+        return {'kind': _np.array('lines'), 'lines': _np.array(result, dtype=_np.str)}
+    raise TypeError("Cannot cache result of type " + type(result).__name__)
+
+
+def _Decode(entry):
+    """
+    Load a cache entry written from _Encode.
+    """
+    with _np.load(entry, allow_pickle=False) as arrays:
+        kind = _np.str(arrays['kind'])
+        if kind == 'matrices':
+            matrices = dict((name, arrays['matrix_' + name]) for name in arrays['matrixNames'].tolist())
+            return _DecodeArrays(arrays, _np.str(arrays['opticsKind'])), matrices
+        return _DecodeArrays(arrays, kind)
+
+
+def _DecodeArrays(arrays, kind):
+    """
+    The result of the given kind from the arrays of a cache entry.
+    """
+    if kind == 'none':
+        return None
+    elif kind == 'bdsdata':
+        data = _BDA()
+        names = arrays['names'].tolist()
+        for name, unit in zip(names, arrays['units'].tolist()):
+            data._AddProperty(name, unit)
+        data._ExtendColumns(dict((name, arrays['column' + _np.str(index)]) for index, name in enumerate(names)))
+        if 'errors' in arrays:
+            data.errors = arrays['errors'].tolist()
+        return data
+    elif kind == 'array':
+        return arrays['data']
+    elif kind == 'fits':
+        return arrays['fits'].tolist(), arrays['fitres'].tolist()
+    elif kind == 'lines':
+        return arrays['lines'].tolist()
+    raise ValueError("Unknown cache entry kind " + kind)
@@ -9,17 +9,25 @@ Data
 Data containers used in converting from Transport to gmad or madx.
 
 Classes:
-BDSData - a list of data read from Transport files.
+BDSData - a table of data read from Transport files, stored by column.
+Where - a condition on the columns of a BDSData, for BDSData.Select.
 ConversionData - a class for holding data during conversion.
 
 """
 
+import bz2 as _bz2
+import collections as _collections
+import fnmatch as _fnmatch
+import gzip as _gzip
+import itertools as _itertools
 import numpy as _np
+import operator as _operator
 import os as _os
 from scipy import constants as _con
 import copy
 
 _useRootNumpy = True
+_useLzma = True
 
 try:
     import root_numpy as _rnp
@@ -27,6 +35,43 @@ except ImportError:
     _useRootNumpy = False
     pass
 
+try:
+    import lzma as _lzma
+except ImportError:
+    try:
+        from backports import lzma as _lzma
+    except ImportError:
+        _useLzma = False
+
+
+def _Decompressor(filepath):
+    """
+    The class to open a compressed file with, found from the first bytes of the file
+    (gzip, bzip2 or xz), or None if the file is not compressed.
+    """
+    with open(filepath, 'rb') as f:
+        magic = f.read(6)
+    if magic[:2] == '\x1f\x8b':
+        return _gzip.GzipFile
+    elif magic[:3] == 'BZh':
+        return _bz2.BZ2File
+    elif magic == '\xfd7zXZ\x00':
+        if not _useLzma:
+            raise IOError("lzma not available - can't read xz compressed file " + filepath)
+        return _lzma.LZMAFile
+    return None
+
+
+def _OpenFile(filepath):
+    """
+    Open a file for reading in binary mode. A compressed file is decompressed in
+    chunks as it is read.
+    """
+    decompressor = _Decompressor(filepath)
+    if decompressor is None:
+        return open(filepath, 'rb')
+    return decompressor(filepath, 'rb')
+
 
 def _Load(filepath):
     extension = filepath.split('.')[-1]
@@ -46,7 +91,7 @@ def _Load(filepath):
 
 def _LoadAsciiHistogram(filepath):
     data = BDSData()
-    f = open(filepath, 'r')
+    f = _OpenFile(filepath)
     for i, line in enumerate(f):
         # first line is header (0 counting)
         if i == 1:
@@ -100,27 +145,322 @@ def _ParseHeaderLine(line):
     return names, units
 
 
-class BDSData(list):
+class _BDSRow(object):
+    """
+    A row of a BDSData instance, read like a dict of column name to value. The values are
+    read from the columns of the data when asked for.
+    """
+    __slots__ = ('_table', '_index')
+
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+
+    def __getitem__(self, name):
+        return self._table._data[name][self._index].tolist()
+
+    def __contains__(self, name):
+        return name in self._table.names
+
+    def __iter__(self):
+        return iter(self._table.names)
+
+    def __len__(self):
+        return len(self._table.names)
+
+    def __eq__(self, other):
+        return dict(self.items()) == (dict(other.items()) if isinstance(other, _BDSRow) else other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+    def keys(self):
+        return list(self._table.names)
+
+    def values(self):
+        return list(self._table.GetItemTuple(self._index))
+
+    def items(self):
+        return zip(self._table.names, self._table.GetItemTuple(self._index))
+
+
+def _RowValues(row):
+    """
+    The values of a row, a _BDSRow or a sequence of values, as a tuple.
+    """
+    if isinstance(row, _BDSRow):
+        return tuple(row.values())
+    return tuple(row)
+
+
+class Where(object):
+    """
+    A condition on the columns of a BDSData, evaluated for all of the rows at once with
+    numpy. Conditions are made with Range, Near, In and Matches and combined with & (and),
+    | (or) and ~ (not), then given to BDSData.Select, Indices or Mask.
+
+    >>> condition = Where.Range('S', 10.0, 20.0) & ~Where.Matches('Name', 'D*')
+
+    function: a function of a BDSData returning a bool array with one value per row.
+    """
+    def __init__(self, function):
+        self._function = function
+
+    def Mask(self, data):
+        """
+        A bool array, True for the rows of data that meet the condition.
+        """
+        return _np.asarray(self._function(data), dtype=bool)
+
+    def __and__(self, other):
+        return Where(lambda data: self.Mask(data) & other.Mask(data))
+
+    def __or__(self, other):
+        return Where(lambda data: self.Mask(data) | other.Mask(data))
+
+    def __invert__(self):
+        return Where(lambda data: ~self.Mask(data))
+
+    @staticmethod
+    def Range(column, low=None, high=None):
+        """
+        low <= value <= high, either limit may be None for no limit.
+        """
+        def Mask(data):
+            values = data.GetColumn(column)
+            mask = _np.ones(len(values), dtype=bool)
+            if low is not None:
+                mask &= values >= low
+            if high is not None:
+                mask &= values <= high
+            return mask
+        return Where(Mask)
+
+    @staticmethod
+    def Near(column, value, tolerance):
+        """
+        value - tolerance <= value <= value + tolerance, as BDSData.MatchValue.
+        """
+        return Where(lambda data: abs(data.GetColumn(column) - value) <= tolerance)
+
+    @staticmethod
+    def In(column, values):
+        """
+        The value is one of values, e.g. element types.
+        """
+        return Where(lambda data: _np.in1d(data.GetColumn(column), list(values)))
+
+    @staticmethod
+    def Matches(column, pattern):
+        """
+        The value, a string, matches the shell style pattern (see fnmatch), e.g. 'Q*'.
+        Each distinct value is matched once.
+        """
+        def Mask(data):
+            unique, inverse = _np.unique(data.GetColumn(column), return_inverse=True)
+            matched = _np.array([_fnmatch.fnmatchcase(value, pattern) for value in unique.tolist()], dtype=bool)
+            return matched[inverse]
+        return Where(Mask)
+
+
+class BDSData(object):
     """
     General class representing simple 2 column data.
 
-    Inherits python list.  It's a list of tuples with extra columns of 'name' and 'units'.
+    A table of rows with named columns, each with a unit. The values are held per column in
+    numpy arrays that grow as rows are appended, so reading a column (GetColumn or the getter
+    named after it, e.g. data.S()) returns the stored array without copying. The array is
+    read only. Iterating over the data gives the rows as tuples.
+
+    data[index] returns a row that is read like a dict of column name to value (row['S'])
+    without building one, GetItemTuple(index) a tuple. data[start:stop:step] returns a
+    BDSData of those rows that shares the columns of data, rows appended to either are
+    not seen by the other.
+
+    A BDSData is a collections.Sequence of its rows, but not a list: rows can be appended
+    and extended, not inserted, removed or replaced.
     """
-    def __init__(self, *args, **kwargs):
-        list.__init__(self, *args, **kwargs)
+    def __init__(self, rows=()):
         self.units   = []
         self.names   = []
         self.columns = self.names
+        self._data    = {}  # column name to array, the first _size entries are used
+        self._size    = 0
+        self._pending = list(rows)  # rows appended since the columns were last filled
+
+    def __len__(self):
+        return self._size + len(self._pending)
+
+    def __iter__(self):
+        self._flush()
+        return _itertools.izip(*[self._Column(name).tolist() for name in self.names])
 
     def __getitem__(self, index):
-        return dict(zip(self.names, list.__getitem__(self, index)))
+        self._flush()
+        if isinstance(index, slice):
+            return self._Slice(index)
+        return _BDSRow(self, self._RowIndex(index))
+
+    def _RowIndex(self, index):
+        index = _operator.index(index)
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("BDSData index out of range")
+        return index
+
+    def _Slice(self, index):
+        # a BDSData sharing the columns, which are copied before rows are stored in them
+        data = BDSData()
+        data._DuplicateNamesUnits(self)
+        data._data = dict((name, column[:self._size][index]) for name, column in self._data.iteritems())
+        data._size = len(xrange(*index.indices(self._size)))
+        return data
+
+    def __getstate__(self):
+        # the getter functions added by _AddMethod can't be pickled, they are added again on unpickling
+        self._flush()
+        state = dict((key, value) for key, value in self.__dict__.iteritems() if key not in self.names)
+        state['_data'] = dict((name, column[:self._size]) for name, column in self._data.iteritems())
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for name in self.names:
+            self._AddMethod(name)
+
+    def __copy__(self):
+        # the names, units and columns are copied, so rows appended to the copy are not
+        # seen by this data, and the getters are bound to the copy
+        state = self.__getstate__()
+        state['names'] = list(self.names)
+        state['units'] = list(self.units)
+        state['columns'] = state['names']
+        state['_data'] = dict((name, column.copy()) for name, column in state['_data'].iteritems())
+        state['_pending'] = []
+        data = BDSData.__new__(BDSData)
+        data.__setstate__(state)
+        return data
+
+    def __deepcopy__(self, memo):
+        data = BDSData.__new__(BDSData)
+        memo[id(self)] = data
+        data.__setstate__(copy.deepcopy(self.__getstate__(), memo))
+        return data
+
+    def __contains__(self, row):
+        return any(item == _RowValues(row) for item in self)
+
+    def __reversed__(self):
+        for index in xrange(len(self) - 1, -1, -1):
+            yield self.GetItemTuple(index)
+
+    def index(self, row):
+        """
+        The index of the first row equal to row, a sequence of values in the order of the names.
+        """
+        values = _RowValues(row)
+        for index, item in enumerate(self):
+            if item == values:
+                return index
+        raise ValueError("Row is not in the data")
+
+    def count(self, row):
+        """
+        The number of rows equal to row, a sequence of values in the order of the names.
+        """
+        values = _RowValues(row)
+        return sum(1 for item in self if item == values)
+
+    def append(self, row):
+        """
+        Add a row, a sequence of values in the order of the names.
+        """
+        self._CheckRow(row)
+        self._pending.append(row)
+
+    def extend(self, rows):
+        """
+        Add rows, each a sequence of values in the order of the names.
+        """
+        rows = list(rows)
+        for row in rows:
+            self._CheckRow(row)
+        self._pending.extend(rows)
+
+    def _CheckRow(self, row):
+        # a row is checked when added, a row of the wrong length would stop the others being stored
+        if len(row) != len(self.names):
+            raise ValueError("Row has " + _np.str(len(row)) + " values for " +
+                             _np.str(len(self.names)) + " columns")
+
+    def _ExtendColumns(self, columns):
+        """
+        Add rows given as a dict of column name to the values of each row (arrays of the
+        same length), without going through the rows.
+        """
+        self._flush()
+        count = len(columns.values()[0]) if columns else 0
+        for name in self.names:
+            values = _np.asarray(columns[name])
+            if values.dtype == object:
+                values = _np.array(values.tolist())
+            self._store(name, values, count)
+        self._size += count
+
+    def _flush(self):
+        """
+        Move the rows appended into the column arrays.
+        """
+        if not self._pending:
+            return
+        rows = self._pending
+        self._pending = []
+        values = zip(*rows)
+        if len(values) != len(self.names):
+            self._pending = rows
+            raise ValueError("Rows have " + _np.str(len(values)) + " values for " +
+                             _np.str(len(self.names)) + " columns")
+        for name, column in zip(self.names, values):
+            self._store(name, _np.array(column), len(rows))
+        self._size += len(rows)
+
+    def _store(self, name, values, count):
+        # store count values after the filled part of a column, growing its array by doubling
+        # and widening its type if needed
+        column = self._data.get(name)
+        if column is None:
+            column = _np.zeros((0,) + values.shape[1:], dtype=values.dtype)
+        dtype = _np.promote_types(column.dtype, values.dtype)
+        shared = column.base is not None  # a column of another BDSData, see _Slice
+        if self._size + count > len(column) or dtype != column.dtype or shared:
+            grown = _np.zeros((max(2 * len(column), self._size + count),) + values.shape[1:], dtype=dtype)
+            grown[:self._size] = column[:self._size]
+            column = grown
+        column[self._size:self._size + count] = values
+        self._data[name] = column
 
     def GetItemTuple(self, index):
         """
         Get a specific entry in the data as a tuple of values rather than a dictionary.
         """
-        return list.__getitem__(self, index)
-        
+        self._flush()
+        return tuple(self._Column(name)[index].tolist() for name in self.names)
+
+    def _Column(self, name):
+        # the filled part of a column, empty for a column that has had no rows stored
+        if name not in self._data:
+            return _np.array([])
+        return self._data[name][:self._size]
+
     def _AddMethod(self, variablename):
         """
         This is used to dynamically add a getter function for a variable name.
@@ -128,8 +468,7 @@ class BDSData(list):
         def GetAttribute():
             if self.names.count(variablename) == 0:
                 raise KeyError(variablename+" is not a variable in this data")
-            ind = self.names.index(variablename)
-            return _np.array([event[ind] for event in self])
+            return self.GetColumn(variablename)
         setattr(self, variablename, GetAttribute)
 
     def ConcatenateMachine(self, *args):
@@ -191,12 +530,7 @@ class BDSData(list):
         Return type is BDSAsciiData
         """
         if hasattr(self, parametername):
-            a = BDSData()                 #build bdsdata2
-            a._DuplicateNamesUnits(self)  #copy names and units
-            pindex = a.names.index(parametername)
-            filtereddata = [event for event in self if abs(event[pindex] - matchvalue) <= tolerance]
-            a.extend(filtereddata)
-            return a
+            return self.Select(Where.Near(parametername, matchvalue, tolerance))
         else:
             print "The parameter: ", parametername, " does not exist in this instance"
 
@@ -207,10 +541,47 @@ class BDSData(list):
 
         Return type is BDSData
         """
-        a = BDSData()
-        a._DuplicateNamesUnits(self)
-        a.extend([event for i, event in enumerate(self) if booleanarray[i]])
-        return a
+        return self._Rows(_np.flatnonzero(_np.asarray(booleanarray, dtype=bool)[:len(self)]))
+
+    def Mask(self, condition):
+        """
+        A bool array, True for the rows that meet condition (a Where instance).
+        """
+        self._flush()
+        return condition.Mask(self)
+
+    def Indices(self, condition):
+        """
+        The indices of the rows that meet condition (a Where instance).
+        """
+        return _np.flatnonzero(self.Mask(condition))
+
+    def Select(self, condition):
+        """
+        The rows that meet condition (a Where instance) as a BDSData.
+
+        >>> quads = data.Select(Where.In('Type', ['QUAD']) & Where.Range('S', 10, 20))
+
+        If the rows are evenly spaced (e.g. a range of S) the result shares the columns of
+        this data as data[start:stop:step] does, otherwise the rows are copied a column at
+        a time.
+        """
+        return self._Rows(self.Indices(condition))
+
+    def _Rows(self, indices):
+        # the rows at indices, sorted and unique, as a slice of the data if evenly spaced
+        self._flush()
+        if len(indices) == 0:
+            return self._Slice(slice(0, 0))
+        steps = _np.diff(indices)
+        if len(steps) == 0 or (steps == steps[0]).all():
+            step = steps[0] if len(steps) else 1
+            return self._Slice(slice(indices[0], indices[-1] + 1, step))
+        data = BDSData()
+        data._DuplicateNamesUnits(self)
+        data._data = dict((name, column[:self._size][indices]) for name, column in self._data.iteritems())
+        data._size = len(indices)
+        return data
 
     def NameFromNearestS(self, S):
         i = self.IndexFromNearestS(S)
@@ -253,12 +624,14 @@ class BDSData(list):
     def GetColumn(self, columnstring):
         """
         Return a numpy array of the values in columnstring in order
-        as they appear in the beamline
+        as they appear in the beamline. The array is the stored column, read only.
         """
         if columnstring not in self.columns:
             raise ValueError("Invalid column name")
-        ind = self.names.index(columnstring)
-        return _np.array([element[ind] for element in self])
+        self._flush()
+        column = self._Column(columnstring)
+        column.flags.writeable = False
+        return column
 
     def __repr__(self):
         s = ''
@@ -267,6 +640,9 @@ class BDSData(list):
         return s
 
 
+_collections.Sequence.register(BDSData)
+
+
 class ConversionData:
     """
     Class used as data container object in Transport2Gmad / Transport2Madx conversion.
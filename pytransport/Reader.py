@@ -15,93 +15,287 @@ ConversionData - a class for holding data during conversion.
 
 """
 
+import collections as _collections
+import copy as _copy
+import glob as _glob
+import itertools as _itertools
+import mmap as _mmap
+import multiprocessing as _multiprocessing
 import numpy as _np
+import os as _os
+import re as _re
+import threading as _threading
+import time as _time
 from Data import BDSData as _BDA
+from Data import _Decompressor, _OpenFile
 import _General
 
+# indicator card lines that mark the start of a problem in a standard output file: a new
+# lattice (0) or fitting with the previous lattice (1, 2)
+_allowedIndicatorLines = ['0  100', '0    0', '0    1', '0    2']
+
+# sigma matrix values parsed from a standard output file, from which the Twiss parameters are derived
+_sigmaColumns = ['sigx', 'sigxp', 'sigy', 'sigyp', 'r21', 'r43']
+
+# Entry of the element list written after the control element that prints each element on a single line.
+_singleLineFlag = 'IO: UNDEFINED TYPE CODE 13. 19. ;'
+
 
 class Reader:
     """
     Class for reading Transport input and output files.
     The output file can be standard output or Beam output.
 
+    All functions accept either a file name or an output file already loaded with
+    Load, in which case the file is not read again.
+
+    A Reader keeps no state between calls, other than the last files indexed by Problems,
+    so one instance can be reused for many files and shared between threads.
+
+    >>> r = Reader()
+    >>> output = r.Load('FOR002.DAT')
+    >>> lattice = r.GetLattice(output)
+    >>> optics = r.GetOptics(output)
+
+    kwargs:
+    cache: pytransport.Cache.OutputCache, default = None.
+    If supplied, the results of GetOptics, GetLattice and GetFits for a file name are
+    stored in the cache and loaded from it when the file has not changed.
     """
-    def __init__(self):
-        self._allowedIndicatorLines = ['0  100', '0    0']
+    _indexedFiles = 8  # files kept indexed by Problems
+
+    def __init__(self, cache=None):
+        self._allowedIndicatorLines = _allowedIndicatorLines
         self.optics = _Optics()
+        self.cache = cache
+        self._indexed = _collections.OrderedDict()  # file path to ((size, modification time), _OutputFile), see Problems
+        self._indexedLock = _threading.Lock()
 
-    def GetOptics(self, inputFile, inputType=None):
+    def Load(self, inputFile):
+        """
+        Read a Transport output file once and locate its sections. The returned
+        object can be passed to any of the Get functions instead of the file name.
+        """
+        return _OpenOutput(inputFile)
+
+    def GetOptics(self, inputFile, inputType=None, columnar=False, workers=None, matrices=None):
         """
         Extract the optics from a Transport output file.
+
+        Returns a pytransport.Data.BDSData instance. If columnar is True, a numpy structured
+        array is returned instead with one field per column (e.g. data['Beta_x']), the Name
+        and Type fields being string arrays. The blocks of a Beam output file that could not
+        be read are left out, with a message for each in the errors attribute of the BDSData.
+
+        workers: int, default = None. If more than 1, the elements of a standard output
+        file are split into chunks that are parsed by a pool of this many processes, for
+        very large files. The result is the same as when read in this process. A compressed
+        standard output file is parsed in this process as it is decompressed.
+
+        matrices: list of strings, default = None. Matrices of every element to read in the
+        same pass as the optics, returned as (optics, dict of name to array) with the rows
+        of each array in the order of the optics:
+            'R': the first order transfer matrix (*TRANSFORM 1*), a (N, 6, 6) float64 array.
+            'Sigma': the beam sigma matrix, with all of the correlations, a (N, 6, 6) float64
+                     array in the units printed (cm, mrad, cm, mrad, cm, percent).
+            'T': the non-zero second order coefficients T_ijk (*TRANSFORM 2*), a structured
+                 array with the fields element, i, j, k and value, the indices from 0.
+            'TDense': the second order matrix as a (N, 6, 6, 6) float32 array.
+        Matrices that are not in the output (e.g. single line output or Beam output) are nan.
+
+        >>> optics, matrices = r.GetOptics('FOR002.DAT', matrices=['R'])
+        >>> rMatrices = matrices['R']
         """
+        return self._fromCache(self._GetOptics, inputFile, inputType, columnar, matrices, workers=workers)
+
+    def _GetOptics(self, inputFile, inputType, columnar, matrices=None, workers=None):
+        if inputType not in ['beam', 'standard'] and not isinstance(inputFile, _OutputFile):
+            # find the format from the start of the file before loading all of it
+            inputFile = _SniffAndLoad(inputFile)
+        elif inputType == 'standard' and not isinstance(inputFile, _OutputFile) and inputFile != '' and \
+                _Decompressor(inputFile) is not None:
+            # a compressed file is parsed as it is decompressed rather than loaded
+            inputFile = _OutputStream(inputFile)
+        if isinstance(inputFile, _OutputStream):
+            return self.optics._getStandardOptics(inputFile, columnar, workers, matrices)
+        output = _OpenOutput(inputFile)
         if isinstance(inputType, _np.str):
             if inputType == 'beam':
-                transdata = self.optics._getBeamOptics(inputFile)
+                transdata = self.optics._getBeamOptics(output, columnar, matrices)
                 return transdata
             elif inputType == 'standard':
-                transdata = self.optics._getStandardOptics(inputFile)
+                transdata = self.optics._getStandardOptics(output, columnar, workers, matrices)
                 return transdata
-    
-        f = open(inputFile)
+
         transdata = None
-        for line in f:
-            # remove any carriage returns (both Mac and Unix)
-            line = line.rstrip('\r\n')
-            splitline = _remove_blanks(line.split(' '))
-            if splitline and splitline[0] == '*BEAM*':  # Is beam output
-                # print "'*BEAM*' found in line " + _np.str(i+1)
-                f.close()
-                transdata = self.optics._getBeamOptics(inputFile)
-                break
-            elif line in self._allowedIndicatorLines:
-                # print "'0    0' found in line " + _np.str(i+1)
-                f.close()
-                transdata = self.optics._getStandardOptics(inputFile)
-                break
-            else:
-                pass
+        if output.IsBeamOutput():
+            transdata = self.optics._getBeamOptics(output, columnar, matrices)
+        elif output.IsStandardOutput():
+            transdata = self.optics._getStandardOptics(output, columnar, workers, matrices)
         if transdata is None:
-            errorstring = "Could not find an indicator in the file for either a beam output file\n"
-            errorstring += "(indicator = '*BEAM*), or a standard output file (indicator = '0    0').\n"
-            errorstring += "Please check the input file or specify the input type with the type argument \n"
-            errorstring += "in the get_output function. Note that the only accepted values for type are \n"
-            errorstring += "'standard' or 'beam'."
-            raise IOError(errorstring)
+            _FormatError()
         return transdata
 
+    def GetOpticsAt(self, inputFile, names=None, last=False, columnar=False):
+        """
+        Extract the optics at the named elements and, if last is True, at the last element
+        of a Transport output file.
+
+        The element boundaries are located without parsing the elements, then only the
+        lines of the requested elements (and of the *BEAM* element setting the momentum
+        before them) are parsed. The rows are those GetOptics returns for the same
+        elements, in the order of the file, so an element with a repeated name gives a
+        row for each occurrence. Names are matched as they appear in the file.
+
+        Returns a pytransport.Data.BDSData instance, or a numpy structured array if
+        columnar is True, as GetOptics.
+
+        >>> optics = r.GetOpticsAt('FOR002.DAT', names=['FF1', 'TARGET'], last=True)
+        """
+        names = list(names) if names is not None else []
+        output = _OpenOutput(inputFile)
+        if output.IsBeamOutput():
+            return self.optics._getBeamOpticsAt(output, names, last, columnar)
+        elif output.IsStandardOutput():
+            return self.optics._getStandardOpticsAt(output, names, last, columnar)
+        _FormatError()
+
+    def Sniff(self, inputFile, maxBytes=1 << 20):
+        """
+        Find the format of a Transport output file from its start, without loading it.
+
+        At most maxBytes are read from the start of the file, in large chunks that are
+        searched for the section markers, until the format is known. For an uncompressed
+        file up to maxBytes are also read from the end, where the optics end and the
+        R matrix table are.
+
+        Returns a dict with:
+        format: 'standard', 'beam' or None if not found.
+        singleLine: whether the single line output flag was found, None if it was not found
+                    and the file was not read to the end.
+        indicator, sentinel, beam, length, position: the byte offsets of the lines starting
+                    the sections (see Load), None if not found in the bytes read.
+        bytesRead: the number of bytes searched.
+        """
+        sniffer = _SniffOutput(inputFile, maxBytes, tail=True)
+        singleLine = sniffer.flagLine is not None
+        if not singleLine and not sniffer.complete:
+            singleLine = None
+        return {'format'     : sniffer.Format(),
+                'singleLine' : singleLine,
+                'indicator'  : sniffer.indicatorLine,
+                'sentinel'   : sniffer.sentinelLine,
+                'beam'       : sniffer.beamLine,
+                'length'     : sniffer.lengthLine,
+                'position'   : sniffer.positionLine,
+                'bytesRead'  : sniffer.bytesRead}
+
+    def FollowOptics(self, inputFile, callback=None, interval=1.0, timeout=None):
+        """
+        Follow a standard output file that is still being written, e.g. during a long fit.
+
+        The file is polled every interval seconds and only the text appended since the last
+        poll is read. Each element is parsed once it is complete, i.e. once the next element
+        has started, and given as a dict with the same columns as a row of GetOptics.
+        Following stops at the end of the optics ('0*LENGTH*'), or when the file has not
+        grown for timeout seconds (if not None).
+
+        Returns a generator of the rows. If callback is given, callback(row) is called for
+        each row instead and FollowOptics returns when following stops.
+
+        >>> for row in r.FollowOptics('FOR002.DAT', timeout=600):
+        ...     print row['Name'], row['Beta_x']
+        """
+        rows = self.optics._followStandardOptics(inputFile, interval, timeout)
+        if callback is None:
+            return rows
+        for row in rows:
+            callback(row)
+
+    def IterOptics(self, inputFile):
+        """
+        Generator of the optics of a standard output file, one element at a time.
+
+        Each element is a dict with the same columns as a row of GetOptics (e.g. row['Beta_x']).
+        The file is read sequentially and only the current element is held in memory, so very
+        long outputs can be aggregated or filtered without building the whole table, and the
+        iteration can be stopped once the element of interest is reached.
+
+        >>> for row in r.IterOptics('FOR002.DAT'):
+        ...     if row['Name'] == 'Q1':
+        ...         break
+        """
+        return self.optics._iterStandardOptics(inputFile)
+
+    def GetOpticsMany(self, inputFiles, workers=None, inputType=None, columnar=False, stack=False):
+        """
+        Extract the optics from many Transport output files using a pool of worker processes.
+
+        inputFiles: list of file names, or a string with a directory (all files in it are read)
+                    or a glob pattern.
+        workers: int, default = None. Number of processes, the number of CPUs if None. With 1
+                 worker the files are read in this process.
+        inputType, columnar: as for GetOptics.
+        stack: bool, default = False. If True, the optics are returned as a dict of 2D numpy
+               arrays of shape (number of files, number of elements) instead of a list. All
+               files that are read must have the same number of elements. The rows of files
+               that could not be read are nan (empty strings for Name and Type).
+
+        Returns (optics, errors) where optics is a list in the order of inputFiles, with None for
+        any file that could not be read, and errors is a dict of file name to error message.
+        Errors are collected rather than raised.
+        """
+        inputFiles = _ExpandFileList(inputFiles)
+        tasks = [(inputFile, inputType, columnar, self.cache) for inputFile in inputFiles]
+        if workers is None:
+            workers = _multiprocessing.cpu_count()
+        if workers == 1 or len(tasks) <= 1:
+            results = map(_ReadOpticsWorker, tasks)
+        else:
+            pool = _multiprocessing.Pool(min(workers, len(tasks)))
+            try:
+                results = pool.map(_ReadOpticsWorker, tasks, chunksize=max(1, len(tasks) // (4 * workers)))
+            finally:
+                pool.close()
+                pool.join()
+
+        optics = []
+        errors = {}
+        for inputFile, (data, error) in zip(inputFiles, results):
+            optics.append(data)
+            if error is not None:
+                errors[inputFile] = error
+        if stack:
+            optics = _StackOptics(optics)
+        return optics, errors
+
     def GetLattice(self, inputFile):
         """
         Function to extract the lattice from a standard output file.
         """
-        flist = _LoadFile(inputFile)
-        latticestart = 0
-        latticeend = 0
-        foundlatticestart = False
-        foundlatticeend = False
+        return self._fromCache(self._GetLattice, inputFile)
+
+    def _GetLattice(self, inputFile):
+        output = _OpenOutput(inputFile)
+        flist = output.lines
+        latticestart = output.indicatorLine
+        latticeend = output.sentinelLine
         lattice = ['OUTPUT LATTICE']
-        for linenum, line in enumerate(flist):
-            if line in self._allowedIndicatorLines:
-                if not foundlatticestart:
-                    latticestart = linenum+1
-                    if flist[linenum+1] == '0INDICATOR VALUE WRONG OR MISSING - ZERO ASSUMED':
-                        latticestart += 1
-                    foundlatticestart = True
-            if line == '0SENTINEL':
-                if not foundlatticeend:
-                    latticeend = linenum
-                    foundlatticeend = True
-        if not foundlatticestart:
-            if not foundlatticeend:
-                raise IOError('No lattice found in ' + inputFile + '.')
+        if latticestart is None:
+            if latticeend is None:
+                raise IOError('No lattice found in ' + output.filename + '.')
             else:
                 errorstring = 'The end of a lattice (line = "0SENTINEL") was found at line ' + _np.str(latticeend + 1) + ',\n'
                 errorstring += 'but the start of a lattice (line = "0    0") was not found. Please check the input file.'
                 raise IOError(errorstring)
-        elif not foundlatticeend:
-                errorstring = 'The start of a lattice (line = "0    0") was found at line ' + _np.str(latticestart - 1) + ',\n'
+        elif latticeend is None:
+                errorstring = 'The start of a lattice (line = "0    0") was found at line ' + _np.str(latticestart) + ',\n'
                 errorstring += 'but the end of a lattice (line = "0SENTINEL") was not found. Please check the input file.'
                 raise IOError(errorstring)
         else:
+            latticestart += 1
+            if flist[latticestart] == '0INDICATOR VALUE WRONG OR MISSING - ZERO ASSUMED':
+                latticestart += 1
             lattice.extend(flist[latticestart:latticeend])
         return lattice
 
@@ -112,356 +306,835 @@ class Reader:
         the second with the first line of each element in the output data, which contains the
         element parameters with their fitted values.
         """
-        flist = _LoadFile(inputFile)
-        fitstart = 0
-        fitend = 0
-        foundfitstart = False
-        foundfitend = False
-        fits = []
-        for linenum, line in enumerate(flist):
-            if not foundfitstart:
-                if line == '0SENTINEL':
-                    fitstart = linenum
-                    foundfitstart = True
-            if not foundfitend:
-                splitline = _remove_blanks(line.split(' '))
-                if splitline and splitline[0] == '*BEAM*' and not foundfitend:
-                    fitend = linenum
-                    foundfitend = True
-        if not foundfitstart:
-            print('No fitting output found.')
+        return self._fromCache(self._GetFits, inputFile)
+
+    def _GetFits(self, inputFile):
+        output = _OpenOutput(inputFile)
+        fits = _FitLines(output)
+        if fits is None:
             return None
-        elif foundfitstart and not foundfitend:
-                errorstring = 'The start of the fitting output (first line containing "0SENTINEL") was found at line ' + _np.str(fitstart-1) + ',\n'
-                errorstring += 'but the end of the fitting output (first line containing "*BEAM*") was not found. Please check the input file.'
-                raise IOError(errorstring)
-        fits.extend(flist[fitstart:fitend])
 
-        output = self.optics._getOptics(flist, inputFile)
-        fitres = [element[0] for element in output]
+        fitres = [element[0] for element in output.Elements()]
 
         return fits, fitres
 
+    def GetFitResults(self, inputFile):
+        """
+        Function to get the results of the fit routine from the standard transport output,
+        parsed from the fitting output only (the lines from "0SENTINEL" to the first "*BEAM*").
+        A file name is read up to the end of the fitting output, the optics are not read.
+
+        Returns two dicts of numpy arrays, None if there is no fitting output:
+
+        parameters, one entry per element line (e.g. *QUAD*) in the fitting output:
+            name: element label, '' if unnamed.
+            type: element type, e.g. 'QUAD'.
+            code: type code.
+            values: (elements, n) float array of the values after the type code and
+                    label, as fitted. Padded with nan for elements with fewer values.
+
+        constraints, one entry per *FIT* line:
+            name: constraint label, '' if unnamed.
+            code: type code, e.g. 10 for a sigma matrix constraint.
+            i, j: matrix element constrained.
+            target: desired value.
+            tolerance: allowed deviation from target.
+            achieved: value reached, nan if not printed.
+
+        >>> parameters, constraints = r.GetFitResults('FOR002.DAT')
+        >>> converged = _np.all(_np.abs(constraints['achieved'] - constraints['target']) <= constraints['tolerance'])
+        """
+        fits = _FitLines(inputFile)
+        if fits is None:
+            return None
+        return _ParseFits(fits)
+
+    def Problems(self, inputFile):
+        """
+        Index the problems of a Transport output file holding several, e.g. a lattice and
+        fits with indicators 1 and 2. Returns a list with one entry per problem, giving its
+        lineRange and byteRange in the file. The Optics(), Lattice() and Fits() of an entry
+        are read from its lines on first use and kept.
+
+        The file is indexed once per Reader: Problems and Problem called again with the same
+        file name return the same problems, unless the file has changed. The last
+        _indexedFiles files indexed are kept.
+
+        >>> problems = r.Problems('FOR002.DAT')
+        >>> optics = problems[1].Optics()
+        """
+        return self._indexedOutput(inputFile).Problems(self)
+
+    def Problem(self, inputFile, number):
+        """
+        The problem number (counted from 0) of a Transport output file, see Problems.
+        """
+        return self.Problems(inputFile)[number]
+
+    def _indexedOutput(self, inputFile):
+        """
+        inputFile as an _OutputFile, kept per file name while the file is unchanged. Only
+        the _indexedFiles files used last are kept, as each holds a memory mapped file open.
+        """
+        if isinstance(inputFile, _OutputFile):
+            return inputFile
+        path = _os.path.abspath(inputFile)
+        try:
+            stat = _os.stat(path)
+        except OSError as e:
+            raise IOError(e.errno, e.strerror, inputFile)
+        version = stat.st_size, stat.st_mtime
+        with self._indexedLock:
+            kept = self._indexed.pop(path, None)
+            if kept is not None and kept[0] == version:
+                self._indexed[path] = kept  # now the most recently used
+                return kept[1]
+        output = _OutputFile(inputFile)
+        with self._indexedLock:
+            self._indexed[path] = version, output
+            while len(self._indexed) > self._indexedFiles:
+                self._indexed.popitem(last=False)
+        return output
+
     def GetLatticeAndOptics(self, inputFile):
         """
         Function to extract the lattice and optics from a standard output file.
         """
-        flist = _LoadFile(inputFile)
-        lattice = self.GetLattice(inputFile)
-        optics = self.optics._getOptics(flist, inputFile)
+        output = _OpenOutput(inputFile)
+        lattice = self.GetLattice(output)
+        optics = [element if isinstance(element, _np.str) else list(element) for element in output.Elements()]
         return lattice, optics
-    
 
-class _Optics:
+    def _fromCache(self, function, inputFile, *args, **kwargs):
+        """
+        Return function(inputFile, *args, **kwargs), using the cache if there is one and inputFile
+        is a file name. The kwargs are not part of the cache key, so must not change the result.
+        """
+        if self.cache is None or isinstance(inputFile, _OutputFile):
+            return function(inputFile, *args, **kwargs)
+        return self.cache.Fetch(inputFile, function.__name__, args, lambda: function(inputFile, *args, **kwargs))
+
+
+class _Sections:
     """
-    Class for reading optics from Transport output files.
-    The optics can be from standard output or Beam output.
+    Line numbers of the sections of a Transport output file, found by passing
+    the lines that may hold a section marker to _markLine in order.
     """
     def __init__(self):
-        self.transdata = {
-            'Sigma_x'   : [],
-            'Sigma_xp'  : [],
-            'Sigma_y'   : [],
-            'Sigma_yp'  : [],
-            'S'         : [],
-            'Alpha_x'   : [],
-            'Alpha_y'   : [],
-            'Beta_x'    : [],
-            'Beta_y'    : [],
-            'Emitt_x'   : [],
-            'Emitt_y'   : [],
-            'Disp_x'    : [],
-            'Disp_y'    : [],
-            'Sigma_p'   : [],
-            'Momentum'  : [],
-            'E'         : [],  # kinetic energy
-            'Name'      : [],
-            'Type'      : []
-            }
-        # TODO: some unit for now, needs to be extracted from output / convert.py !
-        self.transunits = {
-            'Sigma_x'   : 'mm',
-            'Sigma_xp'  : 'mrad',
-            'Sigma_y'   : 'mm',
-            'Sigma_yp'  : 'mrad',
-            'S'         : 'm',
-            'Alpha_x'   : '',
-            'Alpha_y'   : '',
-            'Beta_x'    : 'mm / mrad',
-            'Beta_y'    : 'mm / mrad',
-            'Emitt_x'   : 'mm mrad',
-            'Emitt_y'   : 'mm mrad',
-            'Disp_x'    : '',
-            'Disp_y'    : '',
-            'Sigma_p'   : 'MeV/c',
-            'Momentum'  : 'MeV/c',
-            'E'         : 'MeV',  # kinetic energy
-            'Name'      : '',
-            'Type'      : ''
-            }
-
-    def _processBeamOptics(self, flist):
-        """
-        Process the optics from a Beam output file.
-        """
-        transdata = {
-            'Sigma_x'   : [],
-            'Sigma_xp'  : [],
-            'Sigma_y'   : [],
-            'Sigma_yp'  : [],
-            'S'         : [],
-            'Alpha_x'   : [],
-            'Alpha_y'   : [],
-            'Beta_x'    : [],
-            'Beta_y'    : [],
-            'Emitt_x'   : [],
-            'Emitt_y'   : [],
-            'Disp_x'    : [],
-            'Disp_y'    : [],
-            'Sigma_p'   : [],
-            'Name'      : [],
-            }
-        num_elements = 0
-        for elenum, element in enumerate(flist):
-            if element == '':  # The first line of the section should be a blank line.
-                try:
-                    section = flist[elenum+1:elenum+13]
-
-                    # Get the element name, type and start position (in s)
-                    line0 = section[0]
-                    line0split = line0.split('*')
-                    # typestr = line0split[1]
-                    reststr = line0split[2]
-                    restsplit = reststr.split(' ')
-                    restsplit = _remove_blanks(restsplit)
-                    transdata['S'].append(_np.float(restsplit[2]))
-                    try :
-                        namestr = restsplit[4]
-                    except IndexError:
-                        namestr = ''
-                    transdata['Name'].append(namestr)
-                    # transdata['type'].append(typestr)
-
-                    # Get sigma_x and sigma_xp
-                    line3 = section[3].split(' ')
-                    line3 = _remove_blanks(line3)
-                    transdata['Sigma_x'].append(_np.float(line3[3])/1000)
-                    transdata['Sigma_xp'].append(_np.float(line3[5])/1000)
-
-                    # Get sigma_y and sigma_yp
-                    line4 = section[4].split(' ')
-                    line4 = _remove_blanks(line4)
-                    transdata['Sigma_y'].append(_np.float(line4[3])/1000)
-                    transdata['Sigma_yp'].append(_np.float(line4[5])/1000)
-                    
-                    # Get momentum spread
-                    line5 = section[5].split(' ')
-                    transdata['Sigma_p'].append(_np.float(line5[5])/100)
-                    
-                    # Get alfa and beta twiss transdata for x and y.
-                    line7 = section[7].split(' ')
-                    line7 = _remove_blanks(line7)
-                    transdata['Alpha_x'].append(_np.float(line7[0]))
-                    transdata['Beta_x'].append(_np.float(line7[1]))
-                    transdata['Alpha_y'].append(_np.float(line7[3]))
-                    transdata['Beta_y'].append(_np.float(line7[4]))
-
-                    # Get horizontal and vertical dispersion
-                    line10 = section[10].split(' ')
-                    line10 = _remove_blanks(line10)
-                    transdata['Disp_x'].append(_np.float(line10[2])/10)
-                    transdata['Disp_y'].append(_np.float(line10[5])/10)
-                    
-                    # Terms for calculating the emittance.
-                    term1x = _np.float(line3[3])**2
-                    term2x = (_np.float(line10[2])*(_np.float(line5[5])/100))**2
-                    term1y = _np.float(line4[3])**2
-                    term2y = (_np.float(line10[5])*(_np.float(line5[5])/100))**2
-
-                    # Get horizontal and vertical emittance
-                    emittx = (term1x - term2x) / _np.float(line7[1])
-                    emitty = (term1y - term2y) / _np.float(line7[4])
-                    transdata['Emitt_x'].append(emittx)
-                    transdata['Emitt_y'].append(emitty)
-                
-                    num_elements += 1
-                except ValueError:
-                    errstr = "Could not process section beginning at line " + _np.str(elenum) + " : "
-                    print(errstr)
-                    print " "
-                    print(element)
-            elif element == "EOF -- rewind file":
+        self.indicatorLine = None  # first indicator card line, i.e. '0    0'
+        self.sentinelLine  = None  # first '0SENTINEL', end of the lattice and start of the fits
+        self.beamLine      = None  # first line starting with '*BEAM*', start of the optics
+        self.lengthLine    = None  # last line starting with '0*LENGTH*', end of the optics
+        self.positionLine  = None  # last line starting with '0POSITION', start of the R matrix table
+
+    def _markLine(self, linenum, line):
+        kind = _LineKind(line)
+        if kind == _kindIndicator:
+            if self.indicatorLine is None:
+                self.indicatorLine = linenum
+            return
+        if kind == _kindSentinel:
+            if self.sentinelLine is None:
+                self.sentinelLine = linenum
+            return
+        firstToken = _FirstToken(line)
+        if firstToken == '*BEAM*':
+            if self.beamLine is None:
+                self.beamLine = linenum
+        elif firstToken == '0*LENGTH*':
+            self.lengthLine = linenum
+        elif firstToken == '0POSITION':
+            self.positionLine = linenum
+
+    def IsBeamOutput(self):
+        """
+        True if the file is a beam output file, i.e a '*BEAM*' line is found before any indicator line.
+        """
+        if self.beamLine is None:
+            return False
+        return (self.indicatorLine is None) or (self.beamLine < self.indicatorLine)
+
+    def IsStandardOutput(self):
+        """
+        True if the file is a standard output file, i.e an indicator line is found before any '*BEAM*' line.
+        """
+        if self.indicatorLine is None:
+            return False
+        return (self.beamLine is None) or (self.indicatorLine < self.beamLine)
+
+    def Format(self):
+        """
+        'beam' or 'standard' as found from the markers, None if neither.
+        """
+        if self.IsBeamOutput():
+            return 'beam'
+        elif self.IsStandardOutput():
+            return 'standard'
+        return None
+
+    def _opticsRanges(self, numLines):
+        """
+        The (start, stop) line ranges of the optics output: from the first '*BEAM*' line to the
+        last '0*LENGTH*' line, followed by the R matrix table from the last '0POSITION' line to
+        the end of the file.
+        """
+        opticsStart = self.beamLine
+        opticsEnd = self.lengthLine
+        if opticsStart is None:
+            if opticsEnd is None:
+                raise IOError('No output found in ' + self.filename + '.')
+            else:
+                errorstring = 'The end of a lattice (line containing "0*LENGTH*") was found at ' \
+                              'line ' + _np.str(opticsEnd + 1)+',\n'
+                errorstring += 'but the start of a lattice (first line containing "*BEAM*") was not found. ' \
+                               'Please check the input file.'
+                raise IOError(errorstring)
+        elif opticsEnd is None:
+                errorstring = 'The start of a lattice (first line containing "*BEAM*") was found at ' \
+                              'line ' + _np.str(opticsStart - 1)+',\n'
+                errorstring += 'but the end of a lattice (line containing "0*LENGTH*") was not found. ' \
+                               'Please check the input file.'
+                raise IOError(errorstring)
+        ranges = [(opticsStart, opticsEnd)]
+        # Append rest of the file which should only contain a table of R Matrix elements.
+        if self.positionLine is not None:
+            ranges.append((self.positionLine, numLines))
+        return ranges
+
+
+class _Sniffer(_Sections):
+    """
+    Section markers of a Transport output file found by searching chunks of the file for
+    the marker strings, so that only the lines holding a marker are looked at. The positions
+    are the byte offsets of the marker lines in the (decompressed) file.
+    """
+    _chunkSize = 1 << 16
+    _maxBytes  = 1 << 20  # bytes searched for the format before the whole file, see _SniffAndLoad
+    _markers = _allowedIndicatorLines + ['0SENTINEL', '*BEAM*', '0*LENGTH*', '0POSITION', _singleLineFlag]
+
+    def __init__(self, inputFile, keep=False, markers=None):
+        """
+        markers, if given, are the markers searched for instead of _markers.
+        """
+        _Sections.__init__(self)
+        self.filename = inputFile
+        self.markers   = self._markers if markers is None else markers
+        self.flagLine  = None   # first single line output flag
+        self.flags     = []     # (offset, next line) of each single line output flag, None at the end of the file
+        self.head      = [] if keep else None  # the chunks read, if kept
+        self.bytesRead = 0
+        self.complete  = False  # whether the whole file was searched
+        self._pending  = ''     # incomplete line at the end of the last chunk
+        self._position = 0      # byte offset of the start of _pending
+        self._skipped  = False
+        self._flagOpen = None   # offset of a flag whose next line is in the next chunk
+
+    def _markLine(self, offset, line):
+        firstLines = self.indicatorLine, self.sentinelLine, self.beamLine
+        _Sections._markLine(self, offset, line)
+        if self._skipped:  # the first markers can be in the part of the file that was skipped
+            self.indicatorLine, self.sentinelLine, self.beamLine = firstLines
+        if line == _singleLineFlag and self.flagLine is None:
+            self.flagLine = offset
+
+    def Search(self, infile, maxBytes=None, done=None):
+        """
+        Continue the search of infile for at most maxBytes (to the end if None). Stops after
+        the chunk in which done(self) becomes True.
+        """
+        read = 0
+        while True:
+            size = self._chunkSize if maxBytes is None else min(self._chunkSize, maxBytes - read)
+            if size <= 0:
+                return
+            chunk = infile.read(size)
+            if not chunk:
                 break
+            read += len(chunk)
+            self.bytesRead += len(chunk)
+            if self.head is not None:
+                self.head.append(chunk)
+            text = self._pending + chunk
+            linesEnd = text.rfind('\n') + 1
+            self._searchLines(text[:linesEnd], self._position)
+            self._pending = text[linesEnd:]
+            self._position += linesEnd
+            if done is not None and done(self):
+                return
+        self._searchLines(self._pending, self._position)  # last line without a newline
+        self._pending = ''
+        if self._flagOpen is not None:
+            self.flags.append((self._flagOpen, None))
+            self._flagOpen = None
+        self.complete = not self._skipped
+
+    def FormatKnown(self):
+        """
+        Whether the format is decided, i.e. an indicator line or a '*BEAM*' line was found.
+        """
+        return self.indicatorLine is not None or self.beamLine is not None
+
+    def SingleLineOutputApplied(self):
+        """
+        Whether the control element that prints the element output on a single line was applied,
+        as for _OutputFile.SingleLineOutputApplied: a flag in the optics that is the last line of
+        the file or is followed by an element header, which includes the '0*LENGTH*' line that
+        ends the optics. The whole file must have been searched.
+        """
+        if self.beamLine is None or self.lengthLine is None:
+            return False
+        for offset, nextLine in self.flags:
+            inOptics = self.beamLine <= offset < self.lengthLine or \
+                       (self.positionLine is not None and offset >= self.positionLine)
+            if inOptics and (nextLine is None or _IsElementStart(nextLine)):
+                return True
+        return False
+
+    def Skip(self, infile, offset):
+        """
+        Continue the search from the first line starting at or after byte offset of an uncompressed file.
+        """
+        infile.seek(offset - 1)
+        if infile.read(1) != '\n':
+            infile.readline()
+        self._pending = ''
+        self._position = infile.tell()
+        self._skipped = True
+
+    def _searchLines(self, text, start):
+        if self._flagOpen is not None and text:
+            self.flags.append((self._flagOpen, text.split('\n', 1)[0].rstrip('\r')))
+            self._flagOpen = None
+        lineStarts = set()
+        for marker in self.markers:
+            pos = text.find(marker)
+            while pos != -1:
+                lineStarts.add(text.rfind('\n', 0, pos) + 1)
+                pos = text.find(marker, pos + 1)
+        for lineStart in sorted(lineStarts):
+            lineEnd = text.find('\n', lineStart)
+            if lineEnd == -1:
+                lineEnd = len(text)
+            line = text[lineStart:lineEnd].rstrip('\r')
+            self._markLine(start + lineStart, line)
+            if line == _singleLineFlag:
+                if lineEnd + 1 >= len(text):
+                    self._flagOpen = start + lineStart
+                else:
+                    nextEnd = text.find('\n', lineEnd + 1)
+                    nextLine = text[lineEnd + 1:len(text) if nextEnd == -1 else nextEnd]
+                    self.flags.append((start + lineStart, nextLine.rstrip('\r')))
 
-        data = _BDA()  # Now convert the dict into BDSData instance for final output.
-        for keyName in transdata.keys():
-            data._AddProperty(keyName)
-        for i in range(num_elements):
-            data.append(_GetElementData(i, transdata))
 
-        return data
+class _OutputFile(_Sections):
+    """
+    A Transport output file read from disk once.
+
+    The lines are loaded and the section markers are located in a single scan on
+    construction. The element list of the optics section is segmented on first use
+    and kept, so the lattice, fits, optics and the single line output check can all
+    be answered from the same instance.
+    """
+    def __init__(self, inputFile, flist=None):
+        _Sections.__init__(self)
+        self.filename = inputFile
+        if flist is None:
+            flist = _LoadFile(inputFile)
+        self.lines = flist
+        self._elementlist  = None
+        self._optics       = None
+        self._elementRanges = None
+        self._singleLine   = None
+        self._problems     = None
+        self._lock = _threading.RLock()  # the element list is built once if shared between threads
+        for linenum in self._markerCandidates():
+            self._markLine(linenum, self.lines[linenum])
+
+    def _markerCandidates(self):
+        """
+        Line numbers that may hold a section marker, in order. For a memory mapped file
+        only the lines containing one of the markers are returned.
+        """
+        if isinstance(self.lines, _LineIndex):
+            return self.lines.Find(_allowedIndicatorLines + ['0SENTINEL', '*BEAM*', '0*LENGTH*', '0POSITION'])
+        return xrange(len(self.lines))
+
+    def Elements(self):
+        """
+        The optics section split into a list of elements, see _Optics._getOptics.
+        """
+        with self._lock:
+            if self._elementlist is None:
+                self._elementlist = self._getElements()
+        return self._elementlist
+
+    def Problems(self, reader=None):
+        """
+        The problems of the file (a file can hold several, e.g. a lattice and fits with
+        indicators 1 and 2) as a list of _Problem instances. Each indicator line after
+        the first starts a new problem, the first includes the lines before its indicator.
+        Only the indicator lines are located here, the problems are read when used, with
+        reader (the Reader of the first call, a new one if None).
+        """
+        with self._lock:
+            if self._problems is None:
+                self._problems = self._getProblems(reader or Reader())
+        return self._problems
+
+    def _getProblems(self, reader):
+        if isinstance(self.lines, _LineIndex):
+            candidates = self.lines.Find(_allowedIndicatorLines)
+            byteOffsets = _np.append(self.lines.starts, len(self.lines._data)).tolist()
+        else:
+            candidates = xrange(len(self.lines))
+            byteOffsets = None
+        indicators = [linenum for linenum in candidates if self.lines[linenum] in _allowedIndicatorLines]
+        bounds = [0] + indicators[1:] + [len(self.lines)]
+        problems = []
+        for number, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])):
+            byteRange = None if byteOffsets is None else (byteOffsets[start], byteOffsets[stop])
+            problems.append(_Problem(self, number, (start, stop), byteRange, reader))
+        return problems
+
+    def SingleLineOutputApplied(self):
+        """
+        Whether the control element that prints the element output on a single line was applied.
+        """
+        with self._lock:
+            if self._singleLine is None:
+                # the flag is in the element list if it is the last line of an element, see _ElementEntries,
+                # i.e. the last line of the optics or a line before the header of the next element
+                lines = self.OpticsLines()
+                self._singleLine = any(lines[linenum] == _singleLineFlag and
+                                       (linenum == len(lines) - 1 or _IsElementStart(lines[linenum + 1]))
+                                       for linenum in self.FindOpticsLines([_singleLineFlag]))
+        return self._singleLine
+
+    def OpticsLines(self):
+        """
+        The lines of the optics section, see _Sections._opticsRanges. Found on first use and kept.
+        """
+        with self._lock:
+            if self._optics is None:
+                self._optics = self._opticsLines()
+        return self._optics
+
+    def ElementRanges(self):
+        """
+        The lines of the optics section and the (start, stop) ranges of the lines of each
+        element in them, see _ElementRanges. Found on first use and kept.
+        """
+        with self._lock:
+            if self._elementRanges is None:
+                lines = self.OpticsLines()
+                self._elementRanges = lines, list(_ElementRanges(_ElementEvents(lines)))
+        return self._elementRanges
+
+    def FindOpticsLines(self, substrings):
+        """
+        Line numbers in the OpticsLines of the lines containing any of substrings.
+        """
+        lines = self.OpticsLines()
+        if isinstance(lines, _Lines):
+            found = self.lines.Find(substrings)
+            linenums = _np.searchsorted(lines.rows, found)
+            inOptics = linenums < len(lines.rows)
+            linenums = linenums[inOptics]
+            return linenums[lines.rows[linenums] == found[inOptics]].tolist()
+        return [linenum for linenum, line in enumerate(lines) if any(substring in line for substring in substrings)]
+
+    def _opticsLines(self):
+        ranges = self._opticsRanges(len(self.lines))
+        if isinstance(self.lines, _LineIndex):
+            return _Lines(self.lines, _np.concatenate([_np.arange(start, stop) for start, stop in ranges]))
+        output = []
+        for start, stop in ranges:
+            output.extend(self.lines[start:stop])
+        return output
+
+    def _getElements(self):
+        lines, ranges = self.ElementRanges()
+        return _SplitElements(lines, ranges)
+
+
+class _Problem:
+    """
+    One problem of a Transport output file, the lines from its indicator line to the next.
+
+    number: index of the problem in the file.
+    lineRange: (start, stop) line numbers in the file.
+    byteRange: (start, stop) byte offsets in the (decompressed) file, None if not known.
+    reader: the Reader the optics, lattice and fits are read with.
+
+    The optics, lattice and fits are read from the problem's lines on first use and kept.
+    """
+    def __init__(self, output, number, lineRange, byteRange, reader):
+        self.number = number
+        self.lineRange = lineRange
+        self.byteRange = byteRange
+        self._file = output
+        self._reader = reader
+        self._output = None
+        self._results = {}
+        self._lock = _threading.RLock()
+
+    def Output(self):
+        """
+        The lines of the problem as a loaded output file, see Reader.Load.
+        """
+        with self._lock:
+            if self._output is None:
+                start, stop = self.lineRange
+                if isinstance(self._file.lines, _LineIndex):
+                    lines = self._file.lines.Section(start, stop)
+                else:
+                    lines = self._file.lines[start:stop]
+                self._output = _OutputFile(self._file.filename, lines)
+        return self._output
+
+    def Optics(self, inputType=None, columnar=False):
+        """
+        The optics of the problem, see Reader.GetOptics.
+        """
+        return self._result('_GetOptics', inputType, columnar)
+
+    def Lattice(self):
+        """
+        The lattice of the problem, see Reader.GetLattice.
+        """
+        return self._result('_GetLattice')
+
+    def Fits(self):
+        """
+        The fits of the problem, see Reader.GetFits.
+        """
+        return self._result('_GetFits')
+
+    def FitResults(self):
+        """
+        The parsed fit results of the problem, see Reader.GetFitResults.
+        """
+        return self._result('GetFitResults')
+
+    def _result(self, name, *args):
+        key = (name,) + args
+        with self._lock:
+            if key not in self._results:
+                self._results[key] = getattr(self._reader, name)(self.Output(), *args)
+        return self._results[key]
+
+
+class _OutputStream(_Sections):
+    """
+    A Transport output file read sequentially, once. The section markers are found as the
+    lines are read, as in _OutputFollower, and the lines of the optics are given as they are
+    read, so only the lines of the current element are held in memory.
+    """
+    def __init__(self, inputFile):
+        _Sections.__init__(self)
+        self.filename = inputFile
+
+    def OpticsLines(self):
+        """
+        Generator of the lines of the optics output as in _Sections._opticsRanges, from the first
+        '*BEAM*' line up to the last '0*LENGTH*' line, then the R matrix table from the last
+        '0POSITION' line after it. The lines from a '0*LENGTH*' line on are held until the next
+        one, as they are only part of the optics if there is one.
+        """
+        held = []
+        for linenum, line in enumerate(_ReadLines(self.filename)):
+            lengthLine = self.lengthLine
+            self._markLine(linenum, line)
+            if self.beamLine is None:
+                continue
+            if not self.IsStandardOutput():
+                raise IOError(self.filename + ' is not a standard output file.')
+            if self.lengthLine != lengthLine:
+                for heldLine in held:
+                    yield heldLine
+                held = [line]
+            elif self.lengthLine is None:
+                yield line
+            else:
+                held.append(line)
+        if not self.IsStandardOutput():
+            raise IOError(self.filename + ' is not a standard output file.')
+        if self.lengthLine is None:
+            self._opticsRanges(0)  # raises the error for the missing end of the optics
+        if self.positionLine is not None and self.positionLine > self.lengthLine:
+            for line in held[self.positionLine - self.lengthLine:]:
+                yield line
+
+    def Elements(self):
+        """
+        Generator of the elements of the optics output, each given once the next one has started.
+        """
+        return _IterElements(self.OpticsLines(), None, markLast=True)
+
+
+class _OutputFollower(_Sections):
+    """
+    A Transport output file that is still being written, read from the byte offset
+    reached so far on each poll, see _FollowLines.
+    """
+    def __init__(self, inputFile, interval, timeout):
+        _Sections.__init__(self)
+        self.filename = inputFile
+        self.interval = interval
+        self.timeout = timeout
+
+    def OpticsLines(self):
+        """
+        Generator of the lines of the optics output as they are written, up to and including
+        the '0*LENGTH*' line that ends it.
+        """
+        for linenum, line in enumerate(_FollowLines(self.filename, self.interval, self.timeout)):
+            self._markLine(linenum, line)
+            if self.beamLine is None:
+                continue
+            if not self.IsStandardOutput():
+                raise IOError(self.filename + ' is not a standard output file.')
+            yield line
+            if linenum == self.lengthLine:
+                return
+
+    def Elements(self):
+        """
+        Generator of the elements of the optics output, each given once the next one has started.
+        """
+        return _IterElements(self.OpticsLines(), None)
+
+
+class _Optics:
+    """
+    Class for reading optics from Transport output files.
+    The optics can be from standard output or Beam output.
+
+    An instance holds no state for a file being read: the columns are collected in
+    an _OpticsColumns created for each call and the unit tables are shared class
+    constants, so one instance can be reused and called from several threads.
+    """
+    # TODO: some unit for now, needs to be extracted from output / convert.py !
+    transunits = {
+        'Sigma_x'   : 'mm',
+        'Sigma_xp'  : 'mrad',
+        'Sigma_y'   : 'mm',
+        'Sigma_yp'  : 'mrad',
+        'S'         : 'm',
+        'Alpha_x'   : '',
+        'Alpha_y'   : '',
+        'Beta_x'    : 'mm / mrad',
+        'Beta_y'    : 'mm / mrad',
+        'Emitt_x'   : 'mm mrad',
+        'Emitt_y'   : 'mm mrad',
+        'Disp_x'    : '',
+        'Disp_y'    : '',
+        'Sigma_p'   : 'MeV/c',
+        'Momentum'  : 'MeV/c',
+        'E'         : 'MeV',  # kinetic energy
+        'Name'      : '',
+        'Type'      : ''
+        }
+    # Beam output columns, no units are given.
+    beamunits = {
+        'Sigma_x'   : 'NA',
+        'Sigma_xp'  : 'NA',
+        'Sigma_y'   : 'NA',
+        'Sigma_yp'  : 'NA',
+        'S'         : 'NA',
+        'Alpha_x'   : 'NA',
+        'Alpha_y'   : 'NA',
+        'Beta_x'    : 'NA',
+        'Beta_y'    : 'NA',
+        'Emitt_x'   : 'NA',
+        'Emitt_y'   : 'NA',
+        'Disp_x'    : 'NA',
+        'Disp_y'    : 'NA',
+        'Sigma_p'   : 'NA',
+        'Name'      : 'NA',
+        }
+
+    def _processBeamOptics(self, flist, blocks=None):
+        """
+        Process the optics from a Beam output file. Returns an _OpticsColumns instance and
+        a list of messages for the blocks that could not be read.
 
-    def _processStandardOptics(self, elementlist, filename):
+        The blocks are located first, the fields of every block are gathered and then
+        converted to floats in bulk, so the emittance is calculated for all elements at once.
+        blocks are the line numbers of the blocks to process, all blocks if None.
         """
-        Process the optics from a standard output file.
+        if blocks is None:
+            blocks = _BeamBlockStarts(flist)
+        names, fields, valid = _BeamBlockFields(flist, blocks)
+        values, numeric = _BeamFieldValues(fields)
+        valid &= numeric
+        s, sigx, sigxp, sigy, sigyp, dpp, alfx, betx, alfy, bety, dispx, dispy = values.T
+
+        # Terms for calculating the emittance.
+        term1x = _np.power(sigx, 2)
+        term2x = _np.power(dispx * (dpp / 100), 2)
+        term1y = _np.power(sigy, 2)
+        term2y = _np.power(dispy * (dpp / 100), 2)
+        valid &= (betx != 0) & (bety != 0)
+        with _np.errstate(divide='ignore', invalid='ignore'):
+            emittx = (term1x - term2x) / betx
+            emitty = (term1y - term2y) / bety
+
+        errors = ["Could not process section beginning at line " + _np.str(lineNum)
+                  for lineNum in _np.array(blocks)[~valid]]
+
+        transdata = _OpticsColumns(self.beamunits, _np.count_nonzero(valid))
+        transdata.Extend(S        = s[valid],
+                         Name     = names[valid],
+                         Sigma_x  = sigx[valid] / 1000,
+                         Sigma_xp = sigxp[valid] / 1000,
+                         Sigma_y  = sigy[valid] / 1000,
+                         Sigma_yp = sigyp[valid] / 1000,
+                         Sigma_p  = dpp[valid] / 100,
+                         Alpha_x  = alfx[valid],
+                         Beta_x   = betx[valid],
+                         Alpha_y  = alfy[valid],
+                         Beta_y   = bety[valid],
+                         Disp_x   = dispx[valid] / 10,
+                         Disp_y   = dispy[valid] / 10,
+                         Emitt_x  = emittx[valid],
+                         Emitt_y  = emitty[valid])
+        return transdata, errors
+
+    def _processStandardOptics(self, output, matrices=()):
         """
-        if _General.CheckSingleLineOutputApplied(filename):
-            optics = self._processStandardOpticsSingleLine(elementlist)
+        Process the optics from a standard output file. Returns an _OpticsColumns instance.
+        matrices are collectors (see _matrixTypes) given each element read.
+        """
+        elementlist = output.Elements()
+        if _General.CheckSingleLineOutputApplied(output):
+            optics = self._processStandardOpticsSingleLine(elementlist, matrices)
         else:
-            optics = self._processStandardOpticsMultiLines(elementlist)
+            optics = self._processStandardOpticsMultiLines(elementlist, matrices)
         return optics
 
-    def _processStandardOpticsMultiLines(self, elementlist):
+    def _processStandardOpticsStream(self, output, matrices=()):
+        """
+        Process the optics from an _OutputStream, parsing the elements as they are read, see
+        _streamRecords. Returns an _OpticsColumns instance as _processStandardOptics does.
+        """
+        transdata = _OpticsColumns(self.transunits.keys() + _sigmaColumns, _MatrixCollector.blockSize)
+        for record in self._streamRecords(output, _MatrixCollector.blockSize, matrices):
+            transdata.Append(**record)
+        self._SetTransportData(transdata)
+        return transdata
+
+    def _processStandardOpticsMultiLines(self, elementlist, matrices=()):
         """
         Process the optics from a standard output file when written to multiple lines.
         """
+        transdata = _OpticsColumns(self.transunits.keys() + _sigmaColumns, len(elementlist))
+        for record in self._multiLineRecords(elementlist, matrices=matrices):
+            transdata.Append(**record)
+        self._SetTransportData(transdata)
+        return transdata
+
+    def _multiLineRecords(self, elementlist, momentum=0.0, matrices=(), blockSize=None):
+        """
+        Generator of the values read for each element of multi line output, as keyword
+        arguments for _OpticsColumns.Append. momentum is the momentum before the first element.
+        Each element read is added to the collectors in matrices. The dispersion of a block of
+        blockSize elements (_MatrixCollector.blockSize if None) is decoded at once, see
+        _SetDispersion, so the records are given a block at a time.
+        """
+        if blockSize is None:
+            blockSize = _MatrixCollector.blockSize
         # okElements=['BEAM','CORR','DRIFT','QUAD','SLIT','ADD TO BEAM','BEND','ROTAT','Z RO']
         notokElements = ['AXIS SHIFT']
-        
-        num_elements = 0
+        records = []
+        transformRows = []  # the first and third *TRANSFORM 1* rows of each record
+
         # initialise momentum/energy since not given for every element
-        momentum = 0.0
-        energy = 0.0
         proton_mass = 938.272
+        energy = _np.sqrt(proton_mass*proton_mass + momentum*momentum) - proton_mass if momentum else 0.0
         for element in elementlist:
             if (not isinstance(element, _np.str)) and (len(element) > 1):  # I.e not a fit or matrix-modifying element
                 # type is in between * can have a space (for space charge *SP CH*)
                 elementType = element[0].split('*')[1]
                 if elementType not in notokElements:
                     # rest of first line split with spaces
-                    splitline = _remove_blanks(element[0].split('*')[2].split(' '))
+                    splitline = _Tokens(element[0].split('*')[2])
                     elename = splitline[1].strip('"')
                     if elementType == "BEAM" or elementType == "ACC":
                         momentum = _np.float(splitline[-2])
                         energy = _np.sqrt(proton_mass*proton_mass + momentum*momentum) - proton_mass
-                    s       = _np.float(_remove_blanks(element[1].split(' '))[0])
-                    sigx    = _np.float(_remove_blanks(element[1].split(' '))[3])
-                    sigxp   = _np.float(_remove_blanks(element[2].split(' '))[1])
-                    sigy    = _np.float(_remove_blanks(element[3].split(' '))[1])
-                    sigyp   = _np.float(_remove_blanks(element[4].split(' '))[1])
-                    sigt    = _np.float(_remove_blanks(element[5].split(' '))[1])
-                    sigp    = _np.float(_remove_blanks(element[6].split(' '))[1])
-                    r21     = _np.float(_remove_blanks(element[2].split(' '))[3])
-                    r43     = _np.float(_remove_blanks(element[4].split(' '))[5])
-
-                    dx = _GetTransformLineElements(element[8])[5]
-                    dy = _GetTransformLineElements(element[10])[5]
-
-                    self._SetTransportData(sigx, sigxp, sigy, sigyp, s, dx, dy, sigp, momentum, energy, elename,
-                                           elementType, r21, r43)
-                    num_elements += 1 
-
-        data = _BDA()      # Now convert the dict into BDSData instance for final output.
-        for keyName, unit in self.transunits.iteritems():
-            data._AddProperty(keyName, unit)
-        for i in range(num_elements):
-            data.append(_GetElementData(i, self.transdata))
-
-        return data
-
-    def _SetTransportData(self, sigx, sigxp, sigy, sigyp, s, dx, dy, sigp, momentum, energy, elename, elementType,
-                          r21, r43):
+                    rows    = _SigmaRows(element)
+                    s       = _np.float(rows[0][0])
+                    sigx    = _np.float(rows[0][3])
+                    sigxp   = _np.float(rows[1][1])
+                    sigy    = _np.float(rows[2][1])
+                    sigyp   = _np.float(rows[3][1])
+                    sigt    = _np.float(rows[4][1])
+                    sigp    = _np.float(rows[5][1])
+                    r21     = _np.float(rows[1][3])
+                    r43     = _np.float(rows[3][5])
+
+                    transformRows.extend([element[8], element[10]])
+
+                    for collector in matrices:
+                        collector.Add(element)
+                    records.append(dict(sigx=sigx, sigxp=sigxp, sigy=sigy, sigyp=sigyp, r21=r21, r43=r43,
+                                        S=s, Sigma_p=sigp, Momentum=momentum, E=energy,
+                                        Name=elename, Type=elementType))
+                    if len(records) >= blockSize:
+                        for record in _SetDispersion(records, transformRows):
+                            yield record
+                        records, transformRows = [], []
+        for record in _SetDispersion(records, transformRows):
+            yield record
+
+    def _SetTransportData(self, transdata):
         """
-        Set the beam data.
+        Set the beam data of all elements from the sigma matrix columns parsed into transdata.
         """
-        # Add/Subtract small amount if sin of phase space ellipse rotation is +/-one.
-        # This comes from the output annoyingly rounding the code to one ,
-        # which produces a div by zero later in the beta and gamma calculations.
-        if r21 == 1.0:
-            r21 -= 1e-4
-        if r21 == -1.0:
-            r21 += 1e-4
-
-        if r43 == 1.0:
-            r43 -= 1e-4
-        if r43 == -1.0:
-            r43 += 1e-4
-
-        # Calculate twiss parameters
-        xpint = _np.sqrt(sigxp ** 2 * (1 - r21 ** 2))
-        ypint = _np.sqrt(sigyp ** 2 * (1 - r43 ** 2))
+        sigma = [transdata.Column(name) for name in _sigmaColumns]
+        twiss = _General.TwissFromSigma(*sigma)
+        for name in ['Alpha_x', 'Alpha_y', 'Beta_x', 'Beta_y', 'Emitt_x', 'Emitt_y']:
+            transdata.SetColumn(name, twiss[name])
 
-        ex = sigx * xpint
-        ey = sigy * ypint
+        transdata.SetColumn('Sigma_x', sigma[0] / 1000)   # convert to m
+        transdata.SetColumn('Sigma_xp', sigma[1] / 1000)  # convert to rad
+        transdata.SetColumn('Sigma_y', sigma[2] / 1000)   # convert to m
+        transdata.SetColumn('Sigma_yp', sigma[3] / 1000)  # convert to rad
 
-        if ex is 0:
-            betx = 0
-            gammax = 0
-        else:
-            betx = (sigx ** 2.0) / ex
-            gammax = (sigxp ** 2.0) / ex
-
-        if ey is 0:
-            bety = 0
-            gammay = 0
-        else:
-            bety = (sigy ** 2.0) / ey
-            gammay = (sigyp ** 2.0) / ey
-
-        if _np.isnan(betx):
-            betx = 0
-        if _np.isnan(bety):
-            bety = 0
-        if _np.isnan(gammax):
-            gammax = 0
-        if _np.isnan(gammay):
-            gammay = 0
-
-        alfx2 = (gammax * betx) - 1.0
-        alfy2 = (gammay * bety) - 1.0
-        if (alfx2 < 0):
-            alfx2 = 0
-        if (alfy2 < 0):
-            alfy2 = 0
-
-        alfx = _np.sqrt(alfx2)
-        alfy = _np.sqrt(alfy2)
-
-        self.transdata['Sigma_x'].append(sigx / 1000)  # convert to m
-        self.transdata['Sigma_xp'].append(sigxp / 1000)  # convert to rad
-        self.transdata['Sigma_y'].append(sigy / 1000)  # convert to m
-        self.transdata['Sigma_yp'].append(sigyp / 1000)  # convert to rad
-        self.transdata['S'].append(s)
-        self.transdata['Alpha_x'].append(alfx)
-        self.transdata['Alpha_y'].append(alfy)
-        self.transdata['Beta_x'].append(betx)
-        self.transdata['Beta_y'].append(bety)
-        self.transdata['Emitt_x'].append(ex)
-        self.transdata['Emitt_y'].append(ey)
-        self.transdata['Disp_x'].append(dx)
-        self.transdata['Disp_y'].append(dy)
-        self.transdata['Sigma_p'].append(sigp)
-        self.transdata['Momentum'].append(momentum)
-        self.transdata['E'].append(energy)
-        self.transdata['Name'].append(elename)
-        self.transdata['Type'].append(elementType)
-
-    def _processStandardOpticsSingleLine(self, elementlist):
+    def _processStandardOpticsSingleLine(self, elementlist, matrices=()):
         """
         Process the optics from a standard output file when written to single lines as specified
         by a 13. 19. element in Transport.
         """
         # seperate R matrix table from sigma matrix elements
         rMatrixElements = elementlist[-1]
-        rMatrix = []
+        rMatrix = _RMatrixTable(rMatrixElements[1:])
 
         # Second to last is column headers for R matrix table
         sMatrix = elementlist[:-2]
 
-        for element in rMatrixElements[1:]:
-            rMatrix.append(_remove_blanks(element.split(' ')))
+        transdata = _OpticsColumns(self.transunits.keys() + _sigmaColumns, len(sMatrix))
+        for record in self._singleLineRecords(sMatrix, rMatrix, matrices=matrices):
+            transdata.Append(**record)
+        self._SetTransportData(transdata)
+        return transdata
 
-        num_elements = 0
-        momentum = 0.0
-        energy = 0.0
+    def _singleLineRecords(self, sMatrix, rMatrix, momentum=0.0, matrices=()):
+        """
+        Generator of the values read for each element of single line output, as keyword
+        arguments for _OpticsColumns.Append. The dispersion is taken from the R matrix table,
+        it is nan if rMatrix is None. momentum is the momentum before the first element.
+        Each element read is added to the collectors in matrices.
+        """
         proton_mass = 938.272
+        energy = _np.sqrt(proton_mass*proton_mass + momentum*momentum) - proton_mass if momentum else 0.0
         notokElements = ['AXIS SHIFT']
         okRElements = [3, 4, 5]  # ok element types for R matrix matching
 
         for element in sMatrix:
             if len(element) > 1:  # I.e not a fit or matrix-modifying element
-                elementLine = _remove_blanks(element[0].split(' '))
-                elementLine = _updateElementLine(elementLine)
+                elementLine = _updateElementLine(_Tokens(element[0]))
                 elementType = elementLine[0].strip('*')  # element type
                 # typenum = _np.float(elementLine[1])
 
@@ -480,60 +1153,124 @@ class _Optics:
                         energy = _np.sqrt(proton_mass*proton_mass + momentum*momentum) - proton_mass
 
                     if len(element) > 6:  # In case beam is defined before output format change.
-                        s     = _np.float(_remove_blanks(element[1].split(' '))[0])
-                        sigx  = _np.float(_remove_blanks(element[1].split(' '))[3])
-                        sigxp = _np.float(_remove_blanks(element[2].split(' '))[1])
-                        sigy  = _np.float(_remove_blanks(element[3].split(' '))[1])
-                        sigyp = _np.float(_remove_blanks(element[4].split(' '))[1])
-                        sigt  = _np.float(_remove_blanks(element[5].split(' '))[1])
-                        sigp  = _np.float(_remove_blanks(element[6].split(' '))[1])
+                        rows  = _SigmaRows(element)
+                        s     = _np.float(rows[0][0])
+                        sigx  = _np.float(rows[0][3])
+                        sigxp = _np.float(rows[1][1])
+                        sigy  = _np.float(rows[2][1])
+                        sigyp = _np.float(rows[3][1])
+                        sigt  = _np.float(rows[4][1])
+                        sigp  = _np.float(rows[5][1])
 
                         try:
-                            r21 = _np.float(_remove_blanks(element[2].split(' '))[3])
+                            r21 = _np.float(rows[1][3])
                         except IndexError:
                             r21 = 0
                         try:
-                            r43 = _np.float(_remove_blanks(element[4].split(' '))[5])
+                            r43 = _np.float(rows[3][5])
                         except IndexError:
                             r43 = 0
                     else:
-                        s     = _np.float(_remove_blanks(sigmaLine.split(' '))[0])
-                        sigx  = _np.float(_remove_blanks(sigmaLine.split(' '))[2])
-                        sigxp = _np.float(_remove_blanks(sigmaLine.split(' '))[4])
-                        sigy  = _np.float(_remove_blanks(sigmaLine.split(' '))[6])
-                        sigyp = _np.float(_remove_blanks(sigmaLine.split(' '))[8])
-                        sigt  = _np.float(_remove_blanks(sigmaLine.split(' '))[10])
-                        sigp  = _np.float(_remove_blanks(sigmaLine.split(' '))[12])
-                        r21   = _np.float(_remove_blanks(sigmaLine.split(' '))[14])
-                        r43   = _np.float(_remove_blanks(sigmaLine.split(' '))[15])
-
-                    dx = 0
-                    dy = 0
+                        row   = _Tokens(sigmaLine)
+                        s     = _np.float(row[0])
+                        sigx  = _np.float(row[2])
+                        sigxp = _np.float(row[4])
+                        sigy  = _np.float(row[6])
+                        sigyp = _np.float(row[8])
+                        sigt  = _np.float(row[10])
+                        sigp  = _np.float(row[12])
+                        r21   = _np.float(row[14])
+                        r43   = _np.float(row[15])
 
                     # Find matching R matrix element and get dispersion
-                    for rElement in rMatrix:
-                        if _np.float(rElement[1]) in okRElements and (_np.float(rElement[0]) == s) \
-                                and (rElement[2] == elename):
-                            # Dispersion position dependent on existence of field strength in output
-                            # Field strength written before first *, which should be the 4th element
-                            if rElement.index('*') == 4:
-                                dx = _np.float(rElement[15])
-                                dy = _np.float(rElement[17])
-                            else:
-                                dx = _np.float(rElement[14])
-                                dy = _np.float(rElement[16])
-
-                    self._SetTransportData(sigx, sigxp, sigy, sigyp, s, dx, dy, sigp, momentum, energy, elename,
-                                           elementType, r21, r43)
-                    num_elements += 1
-
-        data = _BDA()      # Now convert the dict into BDSData instance for final output.
-        for keyName, unit in self.transunits.iteritems():
-            data._AddProperty(keyName, unit)
-        for i in range(num_elements):
-            data.append(_GetElementData(i, self.transdata))
-        
-        return data
+                    if rMatrix is None:
+                        dx, dy = _np.nan, _np.nan
+                    else:
+                        dx, dy = rMatrix.Dispersion(s, elename, okRElements)
+
+                    for collector in matrices:
+                        collector.Add(element)
+                    yield dict(sigx=sigx, sigxp=sigxp, sigy=sigy, sigyp=sigyp, r21=r21, r43=r43,
+                               S=s, Disp_x=dx, Disp_y=dy, Sigma_p=sigp, Momentum=momentum, E=energy,
+                               Name=elename, Type=elementType)
+
+    def _iterStandardOptics(self, inputFile, chunkSize=256):
+        """
+        Generator of the optics of a standard output file, one dict per element with the
+        columns of _getStandardOptics. The elements are read in chunks of chunkSize, the
+        Twiss parameters are calculated for a chunk at a time.
+        """
+        if not isinstance(inputFile, _OutputFile):
+            return self._iterRecords(self._streamRecords(_OutputStream(inputFile), chunkSize), chunkSize)
+        output = inputFile
+        if output.SingleLineOutputApplied():
+            records = self._singleLineRecords(_DropLast(output.Elements(), 2),
+                                              _RMatrixTable(output.Elements()[-1][1:]))
+        else:
+            records = self._multiLineRecords(output.Elements(), blockSize=chunkSize)
+        return self._iterRecords(records, chunkSize)
+
+    def _streamRecords(self, output, chunkSize, matrices=()):
+        """
+        The records of the elements of an _OutputStream, parsed as they are read as in
+        _iterStandardOptics. Whether single line output is applied is found before any
+        element is parsed, by searching chunks of the file for the flag (see _Sniffer), and the
+        R matrix table is then read from the end of the file, see _TableLines. Each element
+        read is added to the collectors in matrices.
+        """
+        # the indicator lines are not searched for as they can match many of the lines of the optics
+        sniffer = _Sniffer(output.filename, markers=['*BEAM*', '0*LENGTH*', '0POSITION', _singleLineFlag])
+        with _OpenFile(output.filename) as infile:
+            sniffer.Search(infile)
+        if sniffer.SingleLineOutputApplied():
+            table = _TableLines(output.filename)
+            rMatrix = None if table is None else _RMatrixTable(table[1:])
+            return self._singleLineRecords(_DropLast(output.Elements(), 2), rMatrix, matrices=matrices)
+        return self._multiLineRecords(output.Elements(), matrices=matrices, blockSize=chunkSize)
+
+    def _followStandardOptics(self, inputFile, interval, timeout):
+        """
+        Generator of the optics of a standard output file that is still being written, one
+        dict per element as in _iterStandardOptics.
+        """
+        entries = _OutputFollower(inputFile, interval, timeout).Elements()
+        return self._iterRecords(self._followRecords(entries), 1)
+
+    def _followRecords(self, entries):
+        """
+        Generator of the records of the elements of an output file being written. Whether
+        single line output is applied is only known once the file is complete, so each element
+        is parsed as multi line output if it has more than 6 lines, as single line output
+        otherwise. The R matrix table is written at the end of the file, so the dispersion
+        of single line output is nan.
+        """
+        momentum = 0.0
+        for entry in entries:
+            if isinstance(entry, _np.str) or len(entry) > 6:
+                records = self._multiLineRecords([entry], momentum)
+            else:
+                records = self._singleLineRecords([entry], None, momentum)
+            for record in records:
+                momentum = record['Momentum']
+                yield record
+
+    def _iterRecords(self, records, chunkSize):
+        """
+        Generator of the rows of the optics, as dicts, from the records of _multiLineRecords or
+        _singleLineRecords. The Twiss parameters are calculated for chunkSize records at a time.
+        """
+        names = self.transunits.keys()
+        transdata = _OpticsColumns(names + _sigmaColumns, chunkSize)
+        for record in records:
+            transdata.Append(**record)
+            if len(transdata) == chunkSize:
+                self._SetTransportData(transdata)
+                for row in transdata.Records(names):
+                    yield row
+                transdata = _OpticsColumns(names + _sigmaColumns, chunkSize)
+        self._SetTransportData(transdata)
+        for row in transdata.Records(names):
+            yield row
 
     def _getOptics(self, flist, filename):
         """
@@ -541,86 +1278,9 @@ class _Optics:
         for each element which contains the beam data. Each element should contain the R and TRANSPORT matrices
         which are necessary so the beam info can be calculated.
         """
-        foundOpticsStart = False
-        foundOpticsEnd = False
-        foundRMatrixElementStart = False
-
-        for linenum, line in enumerate(flist):
-            splitline = _remove_blanks(line.split(' '))
-            if splitline and splitline[0] == '*BEAM*' and not foundOpticsStart:
-                opticsStart = linenum
-                foundOpticsStart = True
-            if splitline and splitline[0] == '0*LENGTH*':
-                opticsEnd = linenum
-                foundOpticsEnd = True
-            if splitline and splitline[0] == '0POSITION':
-                rMatrixElementStart = linenum
-                foundRMatrixElementStart = True
-    
-        if not foundOpticsStart:
-            if not foundOpticsEnd:
-                raise IOError('No output found in ' + filename + '.')
-            else:
-                errorstring = 'The end of a lattice (line containing "0*LENGTH*") was found at ' \
-                              'line ' + _np.str(opticsStart + 1)+',\n'
-                errorstring += 'but the start of a lattice (first line containing "*BEAM*") was not found. ' \
-                               'Please check the input file.'
-                raise IOError(errorstring)
-        elif not foundOpticsEnd:
-                errorstring = 'The start of a lattice (first line containing "*BEAM*") was found at ' \
-                              'line ' + _np.str(opticsStart - 1)+',\n'
-                errorstring += 'but the end of a lattice (line containing "0*LENGTH*") was not found. ' \
-                               'Please check the input file.'
-                raise IOError(errorstring)
-        else:
-            output = flist[opticsStart:opticsEnd]
+        return _OutputFile(filename, flist).Elements()
 
-        # Append rest of the file which should only contain a table of R Matrix elements.
-        if foundRMatrixElementStart:
-            output.extend(flist[rMatrixElementStart:])
-
-        # Split the list of all element data into their individual elements.
-        elementlist = []
-        elementstart = False
-        elementend = False
-        finalelement = False
-        for linenum, line in enumerate(output):
-            if linenum == (len(output)-1):
-                finalelement = True
-            try:
-                if (line[1] == '*') or (line[:9] == '0POSITION'):
-                    if line[2:11] == 'TRANSFORM':  # Is midway through element output
-                        pass
-                    elif elementstart is False:  # Current line must be start of the element
-                        elementstart = True
-                        elementstartline = linenum
-                    elif elementstart is True:
-                        elementend = True       # Otherwise the line must be the start of the next element
-                        elementendline = linenum
-                if elementstart and finalelement:
-                    element = output[elementstartline:]
-                    if element[-1][:2] == 'IO':
-                        elementlist.append(element[:-1])
-                        elementlist.append(element[-1])
-                    else:
-                        elementlist.append(element)
-                if elementstart and elementend:  # If the start and end of the element are found, append and reset
-                    element = output[elementstartline:elementendline]
-                    if element[-1][:2] == 'IO':
-                        elementlist.append(element[:-1])
-                        elementlist.append(element[-1])
-                    else:
-                        elementlist.append(element)
-                    elementend = False
-                    elementstart = False
-                if elementstart is False and elementend is False:  # Though if it's been reset, it must be because the
-                    elementstart = True                            # current line is the start of next element, so set
-                    elementstartline = linenum                     # the start line for the next element
-            except IndexError:
-                pass
-        return elementlist
-
-    def _getBeamOptics(self, inputFile):
+    def _getBeamOptics(self, inputFile, columnar=False, matrices=None):
         """
         Returns a BDSData instance of parameters from the input file.
         The input file is assumed to contain the beam data as output
@@ -652,80 +1312,1501 @@ class _Optics:
             example). Some output however appears to have the correct magnitude, but
             incorrect sign. This doesn't affect the resulting beam size, but beware
             that a direct dispersion comparison to another lattice may appear incorrect.
-        """
-        flist = _LoadFile(inputFile)
-        transdata = self._processBeamOptics(flist)
-        return transdata
 
-    def _getStandardOptics(self, inputFile):
+        The blocks that could not be read are left out, a message for each is given in the
+        errors attribute (a list) of the BDSData returned.
+
+        If columnar is True a numpy structured array with one field per column is returned instead,
+        without the messages. The matrices (see Reader.GetOptics) are not in Beam output, so are nan.
         """
-        Get the optics from a standard output file. Returns a pytransport.Data.BDSData object.
+        output = _OpenOutput(inputFile)
+        transdata, errors = self._processBeamOptics(output.lines)
+        if columnar:
+            optics = transdata.ToArray(self.beamunits.keys())
+        else:
+            optics = transdata.ToBDSData(self.beamunits)
+            optics.errors = errors
+        if matrices is None:
+            return optics
+        return optics, dict((name, collector.Array()) for name, collector in
+                            zip(matrices, _MatrixCollectors(matrices, len(transdata))))
+
+    def _getBeamOpticsAt(self, output, names, last, columnar):
         """
-        flist = _LoadFile(inputFile)
-        optics = self._getOptics(flist, inputFile)
-        transdata = self._processStandardOptics(optics, inputFile)
-        return transdata
-
+        The optics of the blocks of a Beam output file with one of names, and the last
+        block that can be read if last is True, see Reader.GetOpticsAt. The messages for
+        the blocks that could not be read are given as in _getBeamOptics.
+        """
+        blocks = _BeamBlockStarts(output.lines)
+        selected = set()
+        if names:
+            if isinstance(output.lines, _LineIndex):
+                linenums = output.lines.Find(names)
+            else:
+                linenums = [linenum for linenum, line in enumerate(output.lines) if any(name in line for name in names)]
+            selected.update(blocks[index] for index in _np.searchsorted(blocks, linenums, 'right') - 1 if index >= 0)
+        if last:
+            for block in reversed(blocks):
+                lastData, lastErrors = self._processBeamOptics(output.lines, [block])
+                if len(lastData):
+                    selected.add(block)
+                    break
+        transdata, errors = self._processBeamOptics(output.lines, sorted(selected))
+        keep = _np.in1d(transdata.Column('Name'), names)
+        if last and len(transdata):
+            keep[-1] = True  # blocks after the last block read are not valid
+        transdata = transdata.Take(_np.flatnonzero(keep))
+        if columnar:
+            return transdata.ToArray(self.beamunits.keys())
+        optics = transdata.ToBDSData(self.beamunits)
+        optics.errors = errors
+        return optics
 
-def _remove_blanks(line):
-    """
-    Removes any blanks from a string (blanks being '' and not white spaces).
-    """
-    newline = ''
-    for element in line:
-        if element != '':
-            newline += element
-            newline += ' '
-    stripline = newline.split(' ')
-    # remove last element as it will be blank (due to added space)
-    return stripline[:-1]
+    def _getStandardOpticsAt(self, output, names, last, columnar):
+        """
+        The optics of the elements of a standard output file with one of names, and the
+        last element if last is True, see Reader.GetOpticsAt. Only the requested elements
+        and the last *BEAM* or *ACC* element before each of them are parsed.
+        """
+        rows = []
+        if not names:
+            # only the last element, which is found without splitting the whole optics
+            record = self._lastStandardRecord(output) if last else None
+            if record is not None:
+                rows.append(record)
+        else:
+            elements = _OpticsElements(self, output)
+            names = set(names)
+            for index in elements.ElementsWith(list(names)):
+                for record in elements.Records(index, elements.MomentumBefore(index)):
+                    if record['Name'] in names:
+                        rows.append(record)
+            if last:
+                for index in xrange(len(elements) - 1, -1, -1):
+                    elementRows = elements.Records(index, elements.MomentumBefore(index))
+                    if elementRows:
+                        if not rows or rows[-1] is not elementRows[-1]:
+                            rows.append(elementRows[-1])
+                        break
+
+        transdata = _OpticsColumns(self.transunits.keys() + _sigmaColumns, len(rows))
+        for record in rows:
+            transdata.Append(**record)
+        self._SetTransportData(transdata)
+        if columnar:
+            return transdata.ToArray(self.transunits.keys())
+        return transdata.ToBDSData(self.transunits)
+
+    def _lastStandardRecord(self, output):
+        """
+        The record of the last element of a standard output file, as _getStandardOpticsAt,
+        None if there is none. The elements are read backwards from the end of the optics, so
+        only the last ones are split, and the momentum before it is read from the last *BEAM*
+        or *ACC* element before it, found by searching the lines.
+        """
+        singleLine = output.SingleLineOutputApplied()
+        lines = output.OpticsLines()
+        rMatrix = None
+
+        def records(entries, momentum):
+            if singleLine:
+                return list(self._singleLineRecords(entries, rMatrix, momentum))
+            return list(self._multiLineRecords(entries, momentum))
+
+        # the entries of the elements from the last, with the first line of their element
+        entries = ((start, entry) for start, stop in _ElementRangesBackwards(lines)
+                   for entry in reversed(_ElementEntries(lines[start:stop])))
+        if singleLine:
+            # the last two entries are not elements, the last is the R matrix table, see _OpticsElements
+            tail = list(_itertools.islice(entries, 2))
+            rMatrix = _RMatrixTable(tail[0][1][1:])
+        for start, entry in entries:
+            if records([entry], 0.0):
+                break
+        else:
+            return None
 
+        momentum = 0.0
+        beamLines = [linenum for linenum in output.FindOpticsLines(['*BEAM*', '*ACC*'])
+                     if linenum < start and (linenum == 0 or _IsElementHeader(lines[linenum]))]
+        for beamLine in reversed(beamLines):
+            element = lines[beamLine:_NextElementStart(lines, beamLine)]
+            beamRecords = [record for record in records(_ElementEntries(element), 0.0)
+                           if record['Type'] in ('BEAM', 'ACC')]
+            if beamRecords:
+                momentum = beamRecords[-1]['Momentum']
+                break
+        return records([entry], momentum)[-1]
 
-def _removeIllegals(line):
+    def _processStandardOpticsParallel(self, output, workers, matrices):
+        """
+        Process the optics from a standard output file with a pool of workers processes.
+        The elements are split into chunks at element boundaries, each chunk is parsed
+        from the momentum of the last *BEAM* or *ACC* element before it, and the chunks
+        are joined in order. The result is the same as _processStandardOptics. Returns the
+        _OpticsColumns and a list of the arrays of the matrices named in matrices.
+        """
+        elements = _OpticsElements(self, output)
+        numChunks = min(len(elements), 4 * workers)
+        bounds = _np.linspace(0, len(elements), numChunks + 1).astype(_np.int64).tolist()
+        tasks = [elements.Chunk(first, last, matrices) for first, last in zip(bounds[:-1], bounds[1:]) if last > first]
+        if len(tasks) <= 1:
+            results = map(_ReadOpticsChunkWorker, tasks)
+        else:
+            pool = _multiprocessing.Pool(min(workers, len(tasks)))
+            try:
+                results = pool.map(_ReadOpticsChunkWorker, tasks, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+
+        transdata = _OpticsColumns(self.transunits.keys() + _sigmaColumns, sum(len(chunk) for chunk, _ in results))
+        for chunk, _ in results:
+            transdata.Extend(**dict((name, chunk.Column(name)) for name in chunk.names))
+        arrays = []
+        counts = [len(chunk) for chunk, _ in results]
+        for index, collector in enumerate(_MatrixCollectors(matrices)):
+            arrays.append(collector.Join([chunkArrays[index] for _, chunkArrays in results], counts))
+        return transdata, arrays
+
+    def _getStandardOptics(self, inputFile, columnar=False, workers=None, matrices=None):
+        """
+        Get the optics from a standard output file. Returns a pytransport.Data.BDSData object,
+        or a numpy structured array with one field per column if columnar is True. The elements
+        are parsed by a pool of processes if workers is more than 1, except for an _OutputStream
+        (a compressed file), which is parsed in this process as it is read. If matrices is given
+        the matrices are returned as well, see Reader.GetOptics.
+        """
+        if workers is not None and workers > 1 and not isinstance(inputFile, _OutputStream):
+            transdata, arrays = self._processStandardOpticsParallel(_OpenOutput(inputFile), workers, matrices or [])
+        else:
+            collectors = _MatrixCollectors(matrices or [])
+            if isinstance(inputFile, _OutputStream):
+                transdata = self._processStandardOpticsStream(inputFile, collectors)
+            else:
+                transdata = self._processStandardOptics(_OpenOutput(inputFile), collectors)
+            arrays = [collector.Array() for collector in collectors]
+        if columnar:
+            optics = transdata.ToArray(self.transunits.keys())
+        else:
+            optics = transdata.ToBDSData(self.transunits)
+        if matrices is None:
+            return optics
+        return optics, dict(zip(matrices, arrays))
+
+
+class _OpticsElements:
     """
-    Function to remove '' and stray characters from lines.
+    The elements of the optics of a standard output file by their line ranges, see
+    _OutputFile.ElementRanges, so that any of them can be parsed without the others.
+    The momentum before an element is found by parsing only the *BEAM* and *ACC*
+    elements that precede it.
+
+    The element list entries of each element are those of _OutputFile.Elements, except
+    that with single line output the last two entries (the R matrix table header and
+    the table) are not elements.
+    """
+    def __init__(self, optics, output):
+        self.optics = optics
+        self.output = output
+        self.lines, self.ranges = output.ElementRanges()
+        self.singleLine = output.SingleLineOutputApplied()
+        self.rMatrix = None
+        self.keep = {}  # number of entries kept of the elements not parsed in full
+        self._starts = _np.array([start for start, stop in self.ranges], dtype=_np.int64)
+        self._records = {}
+        self._beamElements = None
+        if self.singleLine:
+            first = len(self.ranges)
+            tail = []
+            while first > 0 and sum(map(len, tail)) < 2:
+                first -= 1
+                tail.insert(0, self._elementEntries(first))
+            self.rMatrix = _RMatrixTable(tail[-1][-1][1:])
+            keep = sum(map(len, tail)) - 2
+            for index, entries in enumerate(tail, first):
+                self.keep[index] = max(min(keep, len(entries)), 0)
+                keep -= len(entries)
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def _elementEntries(self, index):
+        start, stop = self.ranges[index]
+        return _ElementEntries(self.lines[start:stop])
+
+    def Records(self, index, momentum):
+        """
+        The records of _multiLineRecords or _singleLineRecords of an element given the momentum
+        before it, as a list. Kept for repeated calls.
+        """
+        if (index, momentum) not in self._records:
+            entries = self._elementEntries(index)[:self.keep.get(index)]
+            if self.singleLine:
+                records = self.optics._singleLineRecords(entries, self.rMatrix, momentum)
+            else:
+                records = self.optics._multiLineRecords(entries, momentum)
+            self._records[index, momentum] = list(records)
+        return self._records[index, momentum]
+
+    def ElementsWith(self, substrings):
+        """
+        Sorted indices of the elements with a line containing any of substrings.
+        """
+        found = set()
+        for linenum in self.output.FindOpticsLines(substrings):
+            index = _np.searchsorted(self._starts, linenum, 'right') - 1
+            # the last element can be given twice with the same start, see _ElementRanges
+            for i in xrange(index, -1, -1):
+                if self._starts[i] != self._starts[index]:
+                    break
+                if linenum < self.ranges[i][1]:
+                    found.add(i)
+        return sorted(found)
+
+    def MomentumBefore(self, index):
+        """
+        The momentum before the element index, as carried by _multiLineRecords or _singleLineRecords.
+        """
+        if self._beamElements is None:
+            self._beamElements = self.ElementsWith(['*BEAM*', '*ACC*'])
+        for beamIndex in reversed(self._beamElements[:_np.searchsorted(self._beamElements, index)]):
+            for record in reversed(self.Records(beamIndex, 0.0)):
+                if record['Type'] in ('BEAM', 'ACC'):
+                    return record['Momentum']
+        return 0.0
+
+    def Chunk(self, first, last, matrices):
+        """
+        The task for _ReadOpticsChunkWorker to parse the elements first to last, and the
+        matrices named in matrices. The lines of the elements are copied so that the task
+        can be sent to another process.
+        """
+        lineStart = self.ranges[first][0]
+        lineStop = max(stop for start, stop in self.ranges[first:last])
+        if isinstance(self.lines, _Lines):
+            lines = self.lines.index.Chunk(self.lines.rows[lineStart:lineStop])
+        else:
+            lines = list(self.lines[lineStart:lineStop])
+        ranges = [(start - lineStart, stop - lineStart) for start, stop in self.ranges[first:last]]
+        keep = dict((index - first, count) for index, count in self.keep.iteritems() if first <= index < last)
+        return lines, ranges, keep, self.singleLine, self.rMatrix, self.MomentumBefore(first), matrices
+
+
+class _MatrixCollector:
+    """
+    Base class of the matrices read with the optics of a standard output file, one 6x6
+    matrix per element. A subclass defines _fields(element), what to keep of the lines of
+    an element (None if its matrix is not printed), and _decode(pending), the array of the
+    matrices of the fields kept. The fields are kept as the elements are added and decoded
+    in blocks.
     """
-    illegal = ['"', '', '(', ')']
+    blockSize = 4096  # elements decoded at a time
 
-    modLine = ''
-    for element in line:
-        if element not in illegal:
-            modLine += element
-    return modLine
+    def __init__(self, count=0):
+        self._pending = [None] * count  # the fields of the elements not yet decoded
+        self._blocks = []
 
+    def Add(self, element):
+        """
+        Add the next element, as its lines.
+        """
+        self._pending.append(self._fields(element))
+        if len(self._pending) >= self.blockSize:
+            self._blocks.append(self._decode(self._pending))
+            self._pending = []
 
-def _split_negatives(line):
-    newline = []
-    for element in line:
-        negpos = element.find('-')
-        if negpos > 1:
-            parts = element.split('-')
-            newline.append(parts[0])
-            newline.append('-' + parts[1])
+    def Array(self):
+        """
+        The matrices of the elements added, by default as a (N, 6, 6) float64 array.
+        """
+        self._blocks.append(self._decode(self._pending))
+        self._pending = []
+        return _np.concatenate(self._blocks)
+
+    def Join(self, parts, counts):
+        """
+        Join the arrays of consecutive chunks of counts elements, read by other collectors
+        of the same type, after the elements added to this one.
+        """
+        return _np.concatenate([self.Array()] + list(parts))
+
+
+class _TransferMatrices(_MatrixCollector):
+    """
+    The first order transfer (R) matrices of the elements of a standard output file, from
+    the six rows after the *TRANSFORM 1* line of each element written to multiple lines,
+    decoded with _FortranFields. An element written to a single line has no *TRANSFORM 1*
+    rows, its matrix is nan.
+    """
+    def _fields(self, element):
+        return element[8:14] if len(element) > 6 else None
+
+    def _decode(self, pending):
+        matrices = _np.full((len(pending), 6, 6), _np.nan)
+        printed = [index for index, rows in enumerate(pending) if rows is not None]
+        lines = []
+        for index in printed:
+            rows = list(pending[index])
+            lines.extend(rows + [''] * (6 - len(rows)))
+        values, valid = _FortranFields(lines, _transformFieldStarts, 10)
+        values[~valid] = _np.nan
+        matrices[printed] = values.reshape(len(printed), 6, 6)
+        return matrices
+
+
+class _SigmaMatrices(_MatrixCollector):
+    """
+    The beam (sigma) matrices of the elements of a standard output file. TRANSPORT prints
+    the half widths sqrt(sigma_ii) and the correlations r_ij = sigma_ij / sqrt(sigma_ii sigma_jj)
+    for i > j, from which the matrix is rebuilt, in the units printed (CM, MR, CM, MR, CM, PC).
+
+    An element written to multiple lines has all of the correlations. An element written to a
+    single line only has r21 and r43, the other correlations are nan.
+    """
+    # (row, column) of the correlations, in the order kept
+    _correlations = [(i, j) for i in range(1, 6) for j in range(i)]
+    _singleLine = [(1, 0), (3, 2)]
+
+    def _fields(self, element):
+        if len(element) > 6:
+            rows = _SigmaRows(element)
+            widths = [rows[0][3]] + [row[1] for row in rows[1:]]
+            correlations = []
+            for i, row in enumerate(rows[1:], 1):
+                printed = row[3:3 + i]
+                correlations.extend(printed + [''] * (i - len(printed)))
         else:
-            newline.append(element)
-    return newline
+            row = _Tokens(element[2] if len(element) == 3 else element[1])
+            widths = row[2:13:2]
+            single = dict(zip(self._singleLine, row[14:16]))
+            correlations = [single.get(index, '') for index in self._correlations]
+        return widths + correlations
+
+    def _decode(self, pending):
+        values, valid = _FortranNumbers([fields for fields in pending if fields is not None] or
+                                        _np.empty((0, 21), dtype=_np.str))
+        values[~valid] = _np.nan
+        matrices = _np.full((len(pending), 6, 6), _np.nan)
+        printed = [index for index, fields in enumerate(pending) if fields is not None]
+        widths = values[:, :6]
+        correlations = _np.empty((len(values), 6, 6))
+        rows, columns = zip(*self._correlations)
+        correlations[:, rows, columns] = values[:, 6:]
+        correlations[:, columns, rows] = values[:, 6:]
+        correlations[:, range(6), range(6)] = 1.0
+        matrices[printed] = correlations * widths[:, :, None] * widths[:, None, :]
+        return matrices
+
+
+# the second order coefficients of _SecondOrderTerms, one row per non-zero T_ijk
+_secondOrderDtype = _np.dtype([('element', _np.int64), ('i', _np.int8), ('j', _np.int8),
+                               ('k', _np.int8), ('value', _np.float64)])
+
+
+class _SecondOrderTerms(_MatrixCollector):
+    """
+    The non-zero second order (T) matrix coefficients of the elements of a standard output
+    file, from the lines after the *TRANSFORM 2* line of an element that TRANSPORT prints
+    when second order is on. Each coefficient is written as its index and its value; the
+    index is either the three digits ijk or the two digits jk after the row number i, which
+    starts the first line of each row:
+
+       *TRANSFORM 2*
+        1 11 -1.23456E-01   12  2.34567E+00   ...
+             16  3.45678E-01  ...
+        2 11  4.56789E-03   ...
+
+    Array returns a structured array with the fields element, i, j, k and value, the indices
+    counting from 0, ordered by element. Elements without a *TRANSFORM 2* block have no rows.
+    """
+    def __init__(self, count=0):
+        _MatrixCollector.__init__(self, count)
+        self._added = 0  # elements decoded so far
+
+    def _fields(self, element):
+        lines = None
+        for line in element[7:]:
+            if _LineKind(line) == _kindTransform:
+                lines = [] if _Tokens(line.replace('*', ' ')) == ['TRANSFORM', '2'] else None
+            elif lines is not None:
+                lines.append(_Tokens(line))
+        return lines or None
+
+    def _decode(self, pending):
+        printed = [index for index, lines in enumerate(pending) if lines is not None]
+        terms = self._terms(printed, [pending[index] for index in printed])
+        terms['element'] += self._added
+        self._added += len(pending)
+        return terms
+
+    def _terms(self, printed, elementLines):
+        """
+        The non-zero coefficients in the tokens of the lines of the *TRANSFORM 2* blocks of
+        the elements printed, read for all of the elements at once. The tokens of a line are
+        its index and value fields in turn, after the row number if the line starts a row
+        (has an odd number of tokens).
+        """
+        lines = [tokens for element in elementLines for tokens in element]
+        if not any(lines):
+            return _np.zeros(0, dtype=_secondOrderDtype)
+        counts = _np.array(map(len, lines), dtype=_np.int64)
+        tokens = _np.array([token for tokens in lines for token in tokens], dtype=_np.str)
+        codes = tokens.astype('S%d' % max(tokens.dtype.itemsize, 3)).view(_np.uint8).reshape(len(tokens), -1)
+        length = (codes != 0).sum(axis=1)
+        lineElements = _np.repeat(_np.array(printed, dtype=_np.int64), map(len, elementLines))
+        elements = _np.repeat(lineElements, counts)
+        field = _np.arange(len(tokens)) - _np.repeat(_np.cumsum(counts) - counts, counts)
+        field -= _np.repeat(counts % 2, counts)  # the row number is field -1
+
+        # the row of the two digit indices is the last row number before them in the element
+        last = _np.maximum.accumulate(_np.where(field == -1, _np.arange(len(tokens)), -1))
+        labels = _np.flatnonzero((field >= 0) & (field % 2 == 0))
+        rowOf = _np.maximum(last[labels], 0)
+        threeDigits = length[labels] == 3
+        known = threeDigits | ((length[labels] == 2) & (last[labels] >= 0) &
+                               (elements[rowOf] == elements[labels]) & (length[rowOf] == 1))
+        labels, rowOf, threeDigits = labels[known], rowOf[known], threeDigits[known]
+
+        # the indices from 0: ijk, or i from the row number followed by jk
+        digits = _np.where(threeDigits[:, None], codes[labels, :3],
+                           _np.column_stack((codes[rowOf, 0], codes[labels, :2]))).astype(_np.int64) - ord('1')
+        values, valid = _FortranNumbers(tokens[labels + 1])
+        valid &= ((digits >= 0) & (digits < 6)).all(axis=1)
+        terms = _np.zeros(len(labels), dtype=_secondOrderDtype)
+        terms['element'] = elements[labels]
+        terms['i'] = digits[:, 0]
+        terms['j'] = digits[:, 1]
+        terms['k'] = digits[:, 2]
+        terms['value'] = values
+        return terms[valid & (values != 0)]
+
+    def Join(self, parts, counts):
+        first = self.Array()
+        offset = self._added
+        joined = [first]
+        for part, count in zip(parts, counts):
+            part = part.copy()
+            part['element'] += offset
+            joined.append(part)
+            offset += count
+        return _np.concatenate(joined)
+
+
+class _DenseSecondOrderTerms(_SecondOrderTerms):
+    """
+    The second order (T) matrices of the elements of a standard output file as a dense
+    (N, 6, 6, 6) float32 array, see _SecondOrderTerms. T_ijk is at [i, j, k] as printed
+    (TRANSPORT prints j <= k only), 0 if not printed and nan for an element without a
+    *TRANSFORM 2* block.
+    """
+    def _decode(self, pending):
+        terms = _SecondOrderTerms._decode(self, pending)
+        matrices = _np.full((len(pending), 6, 6, 6), _np.nan, dtype=_np.float32)
+        matrices[[index for index, fields in enumerate(pending) if fields is not None]] = 0.0
+        first = self._added - len(pending)
+        matrices[terms['element'] - first, terms['i'], terms['j'], terms['k']] = terms['value']
+        return matrices
+
+    def Join(self, parts, counts):
+        return _np.concatenate([self.Array()] + list(parts))
+
+
+# matrices that can be read with the optics, see Reader.GetOptics
+_matrixTypes = {'R': _TransferMatrices, 'Sigma': _SigmaMatrices,
+                'T': _SecondOrderTerms, 'TDense': _DenseSecondOrderTerms}
+
+
+def _MatrixCollectors(matrices, count=0):
+    """
+    A collector for each of the names in matrices, see _matrixTypes, holding count elements
+    for which nothing is printed.
+    """
+    collectors = []
+    for name in matrices:
+        if name not in _matrixTypes:
+            raise ValueError("Unknown matrix '" + _np.str(name) + "', the matrices are " +
+                             ', '.join(sorted(_matrixTypes)) + '.')
+        collectors.append(_matrixTypes[name](count))
+    return collectors
+
+
+class _RMatrixTable:
+    """
+    The table of R matrix elements written at the end of a standard output file when the output
+    is on single lines. The rows are parsed once into arrays of the position, type code, name and
+    dispersion, and indexed by (S, name, type code) for the dispersion lookup of each element.
+    """
+    def __init__(self, rows):
+        s = []
+        typeCode = []
+        names = []
+        dx = []
+        dy = []
+        self._index = {}
+        for row in rows:
+            rElement = _Tokens(row)
+            if not rElement:
+                continue
+            s.append(_np.float(rElement[0]))
+            typeCode.append(_np.float(rElement[1]))
+            names.append(rElement[2])
+            # Dispersion position dependent on existence of field strength in output
+            # Field strength written before first *, which should be the 4th element
+            try:
+                if rElement.index('*') == 4:
+                    dx.append(_np.float(rElement[15]))
+                    dy.append(_np.float(rElement[17]))
+                else:
+                    dx.append(_np.float(rElement[14]))
+                    dy.append(_np.float(rElement[16]))
+            except (ValueError, IndexError):
+                dx.append(_np.nan)  # not an element with dispersion
+                dy.append(_np.nan)
+            # a later row for the same element replaces an earlier one
+            self._index[(s[-1], names[-1], typeCode[-1])] = len(names) - 1
+        self.s = _np.array(s, dtype=_np.float64)
+        self.typeCode = _np.array(typeCode, dtype=_np.float64)
+        self.names = _np.array(names, dtype=_np.str)
+        self.dx = _np.array(dx, dtype=_np.float64)
+        self.dy = _np.array(dy, dtype=_np.float64)
+
+    def __len__(self):
+        return len(self.names)
+
+    def Dispersion(self, s, name, typeCodes):
+        """
+        Return the dispersion (dx, dy) of the last row at position s with the given name and one of
+        the typeCodes. Returns (0, 0) if there is no such row.
+        """
+        rows = [self._index.get((s, name, typeCode), -1) for typeCode in typeCodes]
+        row = max(rows)
+        if row == -1:
+            return 0, 0
+        if _np.isnan(self.dx[row]):
+            raise ValueError("R matrix table row " + _np.str(row + 1) + " for " + name + " has no dispersion.")
+        return self.dx[row], self.dy[row]
+
+
+class _OpticsColumns:
+    """
+    Preallocated numpy arrays of the optics, one per column, filled element by element
+    during parsing. The Name and Type columns are held as objects while parsing and
+    returned as string arrays.
+    """
+    _stringColumns = ['Name', 'Type']
+
+    def __init__(self, names, capacity):
+        self.names = list(names)
+        self.size = 0
+        self._columns = {}
+        for name in self.names:
+            dtype = object if name in self._stringColumns else _np.float64
+            self._columns[name] = _np.zeros(max(capacity, 1), dtype=dtype)
+
+    def __len__(self):
+        return self.size
+
+    def Append(self, **values):
+        """
+        Add an element. Columns without a value are left as zero.
+        """
+        if self.size == len(self._columns[self.names[0]]):
+            for name in self.names:
+                self._columns[name] = _np.resize(self._columns[name], 2 * self.size)
+                self._columns[name][self.size:] = 0
+        for name, value in values.iteritems():
+            self._columns[name][self.size] = value
+        self.size += 1
+
+    def Extend(self, **columns):
+        """
+        Add several elements given as a sequence of values per column, all of the same
+        length. Columns without values are left as zero.
+        """
+        count = len(columns.values()[0])
+        if self.size + count > len(self._columns[self.names[0]]):
+            for name in self.names:
+                self._columns[name] = _np.resize(self._columns[name], self.size + count)
+                self._columns[name][self.size:] = 0
+        for name, values in columns.iteritems():
+            self._columns[name][self.size:self.size + count] = values
+        self.size += count
+
+    def Take(self, rows):
+        """
+        A new _OpticsColumns with the elements at the indices rows.
+        """
+        taken = _OpticsColumns(self.names, len(rows))
+        taken.Extend(**dict((name, self._columns[name][:self.size][rows]) for name in self.names))
+        return taken
+
+    def SetColumn(self, name, values):
+        """
+        Set the values of a column for all elements.
+        """
+        self._columns[name][:self.size] = values
+
+    def Column(self, name):
+        """
+        The filled part of a column as a numpy array.
+        """
+        column = self._columns[name][:self.size]
+        if name in self._stringColumns:
+            return column.astype(_np.str)
+        return column
+
+    def ToArray(self, names):
+        """
+        The named columns as a numpy structured array with one field per column.
+        """
+        columns = [self.Column(name) for name in names]
+        data = _np.zeros(self.size, dtype=[(name, column.dtype) for name, column in zip(names, columns)])
+        for name, column in zip(names, columns):
+            data[name] = column
+        return data
+
+    def Records(self, names):
+        """
+        Generator of the named columns of each element as a dict, as a row of pytransport.Data.BDSData.
+        """
+        columns = [self._columns[name][:self.size].tolist() for name in names]
+        for row in zip(*columns):
+            yield dict(zip(names, row))
+
+    def ToBDSData(self, units):
+        """
+        The columns in units (a dict of column name to unit) as a pytransport.Data.BDSData
+        instance with one row per element.
+        """
+        names = units.keys()
+        data = _BDA()
+        for name in names:
+            data._AddProperty(name, units[name])
+        data._ExtendColumns(dict((name, self.Column(name)) for name in names))
+        return data
+
+
+def _ReadOpticsWorker(task):
+    """
+    Read the optics of one file for Reader.GetOpticsMany. Returns (optics, None), or
+    (None, error message) if the file could not be read.
+    """
+    inputFile, inputType, columnar, cache = task
+    try:
+        return Reader(cache=cache).GetOptics(inputFile, inputType, columnar), None
+    except Exception as e:
+        return None, type(e).__name__ + ': ' + _np.str(e)
+
+
+def _ReadOpticsChunkWorker(task):
+    """
+    Parse a chunk of the elements of a standard output file for _Optics._processStandardOpticsParallel.
+    Returns an _OpticsColumns instance with the Twiss parameters set and a list of the arrays
+    of the matrices named in the task.
+    """
+    lines, ranges, keep, singleLine, rMatrix, momentum, matrices = task
+    optics = _Optics()
+    entries = []
+    for index, (start, stop) in enumerate(ranges):
+        entries.extend(_ElementEntries(lines[start:stop])[:keep.get(index)])
+    collectors = _MatrixCollectors(matrices)
+    if singleLine:
+        records = optics._singleLineRecords(entries, rMatrix, momentum, collectors)
+    else:
+        records = optics._multiLineRecords(entries, momentum, collectors)
+    transdata = _OpticsColumns(optics.transunits.keys() + _sigmaColumns, len(entries))
+    for record in records:
+        transdata.Append(**record)
+    optics._SetTransportData(transdata)
+    return transdata, [collector.Array() for collector in collectors]
+
+
+def _ExpandFileList(inputFiles):
+    """
+    A list of file names from a list, a directory or a glob pattern.
+    """
+    if not isinstance(inputFiles, _np.str):
+        return list(inputFiles)
+    if _os.path.isdir(inputFiles):
+        filenames = [_os.path.join(inputFiles, filename) for filename in _os.listdir(inputFiles)]
+        return sorted(filename for filename in filenames if _os.path.isfile(filename))
+    return sorted(_glob.glob(inputFiles))
+
+
+def _StackOptics(optics):
+    """
+    Stack a list of optics (BDSData, structured arrays or None) into a dict of 2D arrays
+    of shape (len(optics), number of elements).
+    """
+    read = [data for data in optics if data is not None]
+    if not read:
+        return {}
+    names = _StackedNames(read[0])
+    numElements = len(read[0])
+    if any(len(data) != numElements for data in read):
+        raise ValueError("Cannot stack optics with different numbers of elements.")
+    if any(sorted(_StackedNames(data)) != sorted(names) for data in read):
+        raise ValueError("Cannot stack optics with different columns.")
+    getColumn = lambda data, name: data[name] if isinstance(data, _np.ndarray) else data.GetColumn(name)
+
+    stacked = {}
+    for name in names:
+        columns = [getColumn(data, name) for data in read]
+        column = _np.array(columns)
+        if column.dtype.kind in 'SU':
+            filled = _np.zeros((len(optics), numElements), dtype=column.dtype)
+        else:
+            filled = _np.full((len(optics), numElements), _np.nan)
+        filled[[i for i, data in enumerate(optics) if data is not None]] = column
+        stacked[name] = filled
+    return stacked
+
+
+def _StackedNames(data):
+    """
+    The column names of optics stacked by _StackOptics, a BDSData or a structured array.
+    """
+    if isinstance(data, _np.ndarray):
+        return list(data.dtype.names)
+    return list(data.names)
+
+
+def _FormatError():
+    errorstring = "Could not find an indicator in the file for either a beam output file\n"
+    errorstring += "(indicator = '*BEAM*), or a standard output file (indicator = '0    0').\n"
+    errorstring += "Please check the input file or specify the input type with the type argument \n"
+    errorstring += "in the get_output function. Note that the only accepted values for type are \n"
+    errorstring += "'standard' or 'beam'."
+    raise IOError(errorstring)
+
+
+def _SniffOutput(inputFile, maxBytes=None, tail=False):
+    """
+    Search the start of a file for the section markers until the format is known (the first
+    '*BEAM*' line is found), reading at most maxBytes. If tail is True, up to maxBytes at
+    the end of an uncompressed file are searched as well. Returns a _Sniffer instance.
+    """
+    if inputFile == '':
+        raise IOError('No file specified')
+    sniffer = _Sniffer(inputFile)
+    with _OpenFile(inputFile) as infile:
+        sniffer.Search(infile, maxBytes, lambda s: s.beamLine is not None)
+        if tail and not sniffer.complete and maxBytes is not None and _Decompressor(inputFile) is None:
+            tailStart = _os.path.getsize(inputFile) - maxBytes
+            if tailStart > sniffer.bytesRead:
+                sniffer.Skip(infile, tailStart)
+            sniffer.Search(infile)
+    return sniffer
+
+
+def _SniffAndLoad(inputFile):
+    """
+    Search at most _Sniffer._maxBytes from the start of a file until its format is known,
+    then load it as an _OutputFile. If the format is not found in the bytes searched, the
+    markers of the whole file are searched, as the format indicator can be further on. The
+    format error is raised if it is not found at all. The file is opened once and the bytes
+    searched are kept, so a compressed Beam output file is only decompressed once. A
+    compressed standard output file is returned as an _OutputStream, so its optics are
+    parsed as it is decompressed, see _Optics._getStandardOptics.
+    """
+    if inputFile == '':
+        raise IOError('No file specified')
+    sniffer = _Sniffer(inputFile, keep=True)
+    with _OpenFile(inputFile) as infile:
+        sniffer.Search(infile, _Sniffer._maxBytes, _Sniffer.FormatKnown)
+        if sniffer.Format() is None and sniffer.complete:
+            _FormatError()
+        if _Decompressor(inputFile) is None:
+            # the markers of the whole file are found as it is loaded
+            output = _OutputFile(inputFile, _LineIndex(inputFile, infile))
+            if output.Format() is None:
+                _FormatError()
+            return output
+        if sniffer.Format() is None:
+            sniffer.head = None  # the rest of the file is not kept, it is decompressed again if loaded
+            sniffer.Search(infile, None, _Sniffer.FormatKnown)
+            if sniffer.Format() is None:
+                _FormatError()
+        if sniffer.IsStandardOutput():
+            return _OutputStream(inputFile)
+        if sniffer.head is None:
+            return _OutputFile(inputFile, _LoadFile(inputFile))
+        return _OutputFile(inputFile, list(_SplitLines(infile, ''.join(sniffer.head))))
+
+
+def _DropLast(iterable, count):
+    """
+    Generator of the items of an iterable except the last count, holding count items at a time.
+    """
+    held = _collections.deque()
+    for item in iterable:
+        held.append(item)
+        if len(held) > count:
+            yield held.popleft()
+
+
+def _FollowLines(inputfile, interval, timeout):
+    """
+    Generator of the lines of a file that is still being written. The file is read from
+    the byte offset reached so far every interval seconds, so earlier content is never
+    read again, and a line is given once its newline is written. Stops when the file has
+    not grown for timeout seconds, never if timeout is None. Raises IOError if the file is
+    truncated or replaced by another file while it is followed.
+    """
+    if inputfile == '':
+        raise IOError('No file specified')
+    followed = _os.stat(inputfile)
+    offset = 0
+    partial = ''
+    idle = 0.0
+    while True:
+        with open(inputfile, 'rb') as infile:
+            status = _os.fstat(infile.fileno())
+            if (status.st_dev, status.st_ino) != (followed.st_dev, followed.st_ino):
+                raise IOError(inputfile + ' was replaced while being followed.')
+            if status.st_size < offset:
+                raise IOError(inputfile + ' was truncated while being followed.')
+            infile.seek(offset)
+            data = infile.read()
+        if data:
+            offset += len(data)
+            idle = 0.0
+            lines = (partial + data).split('\n')
+            partial = lines.pop()
+            for line in lines:
+                yield line.rstrip('\r')
+        elif timeout is not None and idle >= timeout:
+            if partial:
+                yield partial.rstrip('\r')
+            return
+        else:
+            _time.sleep(interval)
+            idle += interval
+
+
+def _ReadLines(inputfile):
+    """
+    Generator of the lines of a file, read sequentially. As for _LoadFile, the newline
+    and any trailing carriage returns are removed.
+    """
+    if inputfile == '':
+        raise IOError('No file specified')
+    with _OpenFile(inputfile) as infile:
+        for line in infile:
+            yield line.rstrip('\n').rstrip('\r')
+
+
+def _TableLines(inputfile):
+    """
+    The lines from the last line starting with '0POSITION' (the R matrix table of single line
+    output) to the end of the file, None if there is none. An uncompressed file is searched
+    backwards from its end, a compressed file is read through.
+    """
+    if _Decompressor(inputfile) is not None:
+        table = None
+        for line in _ReadLines(inputfile):
+            if line[:9] == '0POSITION':
+                table = [line]
+            elif table is not None:
+                table.append(line)
+        return table
+    with open(inputfile, 'rb') as infile:
+        infile.seek(0, _os.SEEK_END)
+        position = infile.tell()
+        chunks = []
+        while position > 0:
+            size = min(_Sniffer._chunkSize, position)
+            position -= size
+            infile.seek(position)
+            chunk = infile.read(size)
+            # the marker can run into the start of the chunk after this one
+            found = (chunk + (chunks[-1][:9] if chunks else '')).rfind('\n0POSITION') + 1
+            chunks.append(chunk)
+            if found == 0 and not (position == 0 and chunk[:9] == '0POSITION'):
+                continue
+            lines = ''.join(reversed(chunks))[found:].split('\n')
+            if lines[-1] == '':
+                del lines[-1]
+            return [line.rstrip('\r') for line in lines]
+    return None
+
+
+def _FitLines(inputFile):
+    """
+    The lines of the fitting output, from the first "0SENTINEL" line to the first "*BEAM*" line.
+    A file name is read sequentially and only up to the "*BEAM*" line. Returns None if there
+    is no "0SENTINEL" line.
+    """
+    if isinstance(inputFile, _OutputFile):
+        fitstart = inputFile.sentinelLine
+        fitend = inputFile.beamLine
+        if fitstart is not None and fitend is not None:
+            return list(inputFile.lines[fitstart:fitend])
+    else:
+        fitstart = None
+        fitend = None
+        fits = []
+        for linenum, line in enumerate(_ReadLines(inputFile)):
+            if fitstart is None and _LineKind(line) == _kindSentinel:
+                fitstart = linenum
+            elif _FirstToken(line) == '*BEAM*':
+                fitend = linenum
+                break
+            if fitstart is not None:
+                fits.append(line)
+        if fitstart is not None and fitend is not None:
+            return fits
+    if fitstart is None:
+        print('No fitting output found.')
+        return None
+    errorstring = 'The start of the fitting output (first line containing "0SENTINEL") was found at line ' + _np.str(fitstart-1) + ',\n'
+    errorstring += 'but the end of the fitting output (first line containing "*BEAM*") was not found. Please check the input file.'
+    raise IOError(errorstring)
+
+
+# leading number of a field of the fitting output, which can be followed by a unit or fit flag (e.g. 5.0A, 1.000M)
+_fitNumber = _re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eEdD][-+]?\d+)?')
+
+# fields of a *FIT* line after the type code
+_constraintFields = ['i', 'j', 'target', 'tolerance', 'achieved']
+
+
+def _ParseFits(fits):
+    """
+    Parse the element and *FIT* lines of the fitting output into the parameter and
+    constraint arrays returned by Reader.GetFitResults.
+    """
+    parameters = {'name': [], 'type': [], 'code': [], 'values': []}
+    constraints = {'name': [], 'code': []}
+    for key in _constraintFields:
+        constraints[key] = []
+    for line in fits:
+        line = line.lstrip(' ')
+        if line[:1] != '*' or line.count('*') < 2:
+            continue
+        # type is in between * can have a space (e.g. *Z ROT*, *SP CH*)
+        elementType = line.split('*')[1]
+        if elementType == '':
+            continue
+        name, values = _FitFields(line[len(elementType) + 2:])
+        if elementType == 'FIT':
+            values = values + [_np.nan] * (1 + len(_constraintFields) - len(values))
+            constraints['name'].append(name)
+            constraints['code'].append(values[0])
+            for key, value in zip(_constraintFields, values[1:]):
+                constraints[key].append(value)
+        else:
+            parameters['name'].append(name)
+            parameters['type'].append(elementType)
+            parameters['code'].append(values[0] if values else _np.nan)
+            parameters['values'].append(values[1:])
+
+    width = max([len(values) for values in parameters['values']] + [0])
+    values = _np.full((len(parameters['values']), width), _np.nan)
+    for row, elementValues in enumerate(parameters['values']):
+        values[row, :len(elementValues)] = elementValues
+    parameters['values'] = values
+    for data in (parameters, constraints):
+        for key in data:
+            if key in ('name', 'type'):
+                data[key] = _np.array(data[key], dtype=_np.str)
+            elif key != 'values':
+                data[key] = _np.array(data[key], dtype=_np.float64)
+    return parameters, constraints
+
+
+def _FitFields(text):
+    """
+    The label (in double or single quotes, '' if none) and the leading numbers of the
+    other fields of a line of the fitting output. Fields that are not numbers are skipped.
+    """
+    name = ''
+    for quote in ('"', "'"):
+        start = text.find(quote)
+        end = text.find(quote, start + 1)
+        if start != -1 and end != -1:
+            name = text[start + 1:end]
+            text = text[:start] + ' ' + text[end + 1:]
+            break
+    values = []
+    for field in text.replace(';', ' ').split():
+        match = _fitNumber.match(field)
+        if match is not None:
+            values.append(float(match.group(0).replace('d', 'e').replace('D', 'e')))
+    return name, values
+
+
+def _OpenOutput(inputFile):
+    """
+    Return inputFile as an _OutputFile, loading it from disk if a file name is supplied.
+    """
+    if isinstance(inputFile, _OutputFile):
+        return inputFile
+    return _OutputFile(inputFile)
+
+
+# Kinds of line of an output file, see _LineKind. The sigma matrix and R matrix table rows
+# are told apart by their place in an element rather than by their contents.
+_kindOther     = 0
+_kindBlank     = 1  # empty, which starts a block of Beam output
+_kindIndicator = 2  # indicator card line, see _allowedIndicatorLines
+_kindSentinel  = 3  # '0SENTINEL'
+_kindHeader    = 4  # first line of an element of the optics, '*TYPE*' or '0POSITION'
+_kindTransform = 5  # '*TRANSFORM*' line within an element
+
+
+def _LineKind(line):
+    """
+    Classify a line of an output file as one of the _kind constants.
+    """
+    if len(line) >= 2 and (line[1] == '*' or line[:9] == '0POSITION'):
+        if line[2:11] == 'TRANSFORM':
+            return _kindTransform
+        return _kindHeader
+    if line in _allowedIndicatorLines:
+        return _kindIndicator
+    if line == '0SENTINEL':
+        return _kindSentinel
+    if line == '':
+        return _kindBlank
+    return _kindOther
+
+
+def _Tokens(line):
+    """
+    The tokens of a line split at spaces with the empty ones removed. All of the output
+    parsers split lines with this, so each line they read is split once.
+    """
+    if '\t' in line or '\r' in line or '\n' in line or '\x0b' in line or '\x0c' in line:
+        # str.split() would also split at these
+        return [token for token in line.split(' ') if token]
+    return line.split()
+
+
+def _SigmaRows(element):
+    """
+    The tokens of the six lines after the first line of an element written to multiple lines,
+    which hold the position and the sigma matrix.
+    """
+    return [_Tokens(line) for line in element[1:7]]
+
+
+def _FirstToken(line):
+    """
+    The first space separated entry of a line, equivalent to _Tokens(line)[0].
+    """
+    return line.lstrip(' ').split(' ', 1)[0]
+
+
+def _BeamBlockStarts(flist):
+    """
+    Line numbers of the blank lines that start an element block in a Beam output file,
+    up to the end of file marker.
+    """
+    if isinstance(flist, _LineIndex):
+        blanks = _np.flatnonzero(flist.starts == flist.ends)
+        for lineNum in flist.Find(['EOF -- rewind file']):
+            if flist[lineNum] == 'EOF -- rewind file':
+                blanks = blanks[blanks < lineNum]
+                break
+        return blanks.tolist()
+    blanks = []
+    for lineNum, line in enumerate(flist):
+        if _LineKind(line) == _kindBlank:
+            blanks.append(lineNum)
+        elif line == 'EOF -- rewind file':
+            break
+    return blanks
+
+
+def _BeamBlockFields(flist, blocks):
+    """
+    The element names and the numeric fields (as strings) of the blocks of a Beam output
+    file starting with the blank lines in blocks. Each block is the 12 lines after the
+    blank line:
+
+    0   *DRIFT*      z = 34.372 m NAME
+    3    horz. Par. :   18.361 mm   23.134 mrad    0.997
+    4    vert. Par. :    8.447 mm   10.242 mrad   -0.995
+    5   *TWISS PARAMETERS* (for dp/p = 1.000 % )
+    7    -13.51800   10.75807 m      9.55361    7.92270 m
+    10    -14.22000   -0.64752   -9.32539      0.13646    0.97529    0.00000
+
+    The fields are s, sigma x, x', y, y', dp/p, alpha x, beta x, alpha y, beta y and
+    the dispersion terms of the first transform matrix row. Each kind of line is split
+    for all blocks together. Returns an array of names, a (blocks, 12) string array of
+    fields and a bool array that is False for the blocks that are incomplete.
+    """
+    blocks = _np.array(blocks, dtype=_np.int64)
+    complete = blocks + 11 < len(flist)
+    rows = blocks[complete] + 1
+
+    def lines(offset):
+        if isinstance(flist, _LineIndex):
+            return flist.Take(rows + offset)
+        return [flist[row] for row in (rows + offset).tolist()]
+
+    parts = [line.split('*') for line in lines(0)]
+    ok = _np.array(map(len, parts), dtype=_np.int64) > 2
+    line0 = [_Tokens(part[2]) if len(part) > 2 else [] for part in parts]
+    tokenLines = [(line0, [2]),
+                  (map(_Tokens, lines(3)), [3, 5]),
+                  (map(_Tokens, lines(4)), [3, 5]),
+                  ([line.split(' ') for line in lines(5)], [5]),
+                  (map(_Tokens, lines(7)), [0, 1, 3, 4]),
+                  (map(_Tokens, lines(10)), [2, 5])]
+
+    columns = []
+    for tokens, fieldNums in tokenLines:
+        ok &= _np.array(map(len, tokens), dtype=_np.int64) > max(fieldNums)
+        for i in fieldNums:
+            columns.append([lineTokens[i] if len(lineTokens) > i else '0' for lineTokens in tokens])
+    columns = _np.array(columns, dtype=_np.str).reshape(12, len(rows))
+
+    fields = _np.zeros((len(blocks), 12), dtype=columns.dtype)
+    fields[:] = '0'
+    fields[complete] = columns.T
+    names = _np.zeros(len(blocks), dtype=object)
+    names[:] = ''
+    names[complete] = [lineTokens[4] if len(lineTokens) > 4 else '' for lineTokens in line0]
+    valid = complete.copy()
+    valid[complete] = ok
+    return names, fields, valid
+
+
+def _BeamFieldValues(fields):
+    """
+    Convert the (blocks, 12) string array of fields of the Beam output blocks to floats.
+    Returns the float array and a bool array that is False for the blocks with a field
+    that is not a number.
+    """
+    values, valid = _FortranNumbers(fields)
+    return values, valid.all(axis=1)
+
+
+# number with an exponent written without the E, as Fortran does for exponents of three digits
+_fortranExponent = _re.compile(r'([-+]?(?:\d+\.?\d*|\.\d+))([-+]\d+)$')
+
+
+def _FortranNumber(text):
+    """
+    Decode one numeric field of TRANSPORT output, see _FortranNumbers. Returns (value, valid).
+    """
+    try:
+        return float(text), True
+    except ValueError:
+        pass
+    tokens = text.split()
+    if not tokens:
+        return 0.0, False
+    token = tokens[0].replace('D', 'E').replace('d', 'e')  # first entry, as _Tokens(text)[0]
+    try:
+        return float(token), True
+    except ValueError:
+        pass
+    match = _fortranExponent.match(token)
+    if match is not None:
+        return float(match.group(1) + 'E' + match.group(2)), True
+    return 0.0, False  # e.g. '*******' for a number too wide for the field
+
+
+def _FortranNumbers(texts):
+    """
+    Decode an array of numeric fields of TRANSPORT output (strings) to floats at once.
+    As well as plain numbers, Fortran D exponents (1.5D-03) and exponents written without
+    the E (1.5-103) are read. Blank fields, fields of '*' written for a number too wide for
+    the field and anything else that is not a number are invalid.
+
+    Returns a float array and a bool array of the same shape, False for the invalid fields,
+    which are 0. Plain decimal fields are decoded from their characters with array
+    arithmetic, see _DecodeDecimals, the others one by one.
+    """
+    texts = _np.ascontiguousarray(texts, dtype=_np.str)
+    flat = texts.reshape(-1)
+    codes = flat.view(_np.uint8).reshape(len(flat), flat.dtype.itemsize)
+    values, valid = _DecodeDecimals(codes)
+    for index in _np.flatnonzero(~valid):
+        values[index], valid[index] = _FortranNumber(flat[index])
+    return values.reshape(texts.shape), valid.reshape(texts.shape)
+
+
+# powers of ten that are exact as float64
+_floatPowers = 10.0 ** _np.arange(23)
+
+
+def _DecodeDecimals(codes):
+    """
+    Decode fields of the form [sign]digits[.digits][E[sign]digits], surrounded by spaces,
+    from their characters (a uint8 array with one field per row, 0 as padding) without
+    calling float(). The characters of all the fields are read a column at a time, the
+    digits being summed as an integer which is then scaled by a power of ten in one
+    operation. That is rounded as float() rounds when the integer has at most 15 digits
+    and the power is at most 22, other fields are not decoded.
+
+    Returns the values and a bool array that is True for the fields decoded.
+    """
+    numRows = len(codes)
+    mantissa = _np.zeros(numRows, dtype=_np.int64)
+    exponent = _np.zeros(numRows, dtype=_np.int64)
+    numDigits = _np.zeros(numRows, dtype=_np.int64)
+    fraction = _np.zeros(numRows, dtype=_np.int64)  # digits after the point
+    expDigits = _np.zeros(numRows, dtype=_np.int64)
+    started = _np.zeros(numRows, dtype=bool)
+    ended = _np.zeros(numRows, dtype=bool)
+    point = _np.zeros(numRows, dtype=bool)
+    seenE = _np.zeros(numRows, dtype=bool)
+    afterE = _np.zeros(numRows, dtype=bool)
+    negative = _np.zeros(numRows, dtype=bool)
+    expNegative = _np.zeros(numRows, dtype=bool)
+    bad = _np.zeros(numRows, dtype=bool)
+    for char in _np.ascontiguousarray(codes.T):
+        digit = char - ord('0')
+        isDigit = digit < 10  # unsigned, so characters below '0' are large
+        isPoint = char == ord('.')
+        isMinus = char == ord('-')
+        isSign = isMinus | (char == ord('+'))
+        isE = (char == ord('E')) | (char == ord('e'))
+        isSpace = (char == ord(' ')) | (char == 0)
+        bad |= ~(isDigit | isPoint | isSign | isE | isSpace)
+        ended |= started & isSpace
+        bad |= ended & ~isSpace  # more than one entry
+        inMantissa = isDigit & ~seenE
+        mantissa *= _np.where(inMantissa, 10, 1)
+        mantissa += digit * inMantissa
+        numDigits += inMantissa
+        fraction += inMantissa & point
+        inExponent = isDigit & seenE
+        if inExponent.any():
+            exponent *= _np.where(inExponent, 10, 1)
+            exponent += digit * inExponent
+            expDigits += inExponent
+        bad |= isPoint & (point | seenE)
+        bad |= isE & (seenE | ~started)
+        bad |= isSign & ((~seenE & started) | (seenE & ~afterE))  # signs only at the start and after the E
+        point |= isPoint
+        negative |= isMinus & ~seenE
+        expNegative |= isMinus & seenE
+        started |= inMantissa | isPoint | isSign
+        afterE = isE
+        seenE |= isE
+    bad |= (numDigits == 0) | (numDigits > 15) | (seenE & ((expDigits == 0) | (expDigits > 3)))
+    power = _np.where(expNegative, -exponent, exponent) - fraction
+    decoded = ~bad & (_np.abs(power) <= 22)
+    scale = _floatPowers[_np.minimum(_np.abs(power), 22)]
+    values = mantissa.astype(_np.float64)
+    values = _np.where(power >= 0, values * scale, values / scale)
+    values[negative] *= -1
+    values[~decoded] = 0.0
+    return values, decoded
+
+
+def _FortranFields(lines, starts, width):
+    """
+    Decode fixed width numeric fields of a block of lines at once, see _FortranNumbers.
+    starts are the columns at which the fields start, each field is width characters. As
+    the fields are cut by column, a number written against the previous one (e.g. the
+    '-4.56' of '1.23-4.56') is read as its own field. Lines too short for a field give a
+    blank field.
+
+    Returns float and bool arrays of shape (len(lines), len(starts)), see _FortranNumbers.
+    """
+    length = max(starts) + width
+    chars = _np.array(list(lines), dtype='S' + _np.str(length)).reshape(-1)
+    codes = _np.zeros((len(chars), length), dtype=_np.uint8)
+    if len(chars):
+        codes[:, :chars.dtype.itemsize] = chars.view(_np.uint8).reshape(len(chars), chars.dtype.itemsize)
+    fields = _np.concatenate([codes[:, start:start + width] for start in starts], axis=1)
+    fields = _np.ascontiguousarray(fields).view('S' + _np.str(width)).reshape(len(chars), len(starts))
+    return _FortranNumbers(fields)
+
+
+def _removeIllegals(line):
+    """
+    Function to remove '' and stray characters from lines.
+    """
+    return line.translate(None, '"()')
 
 
 def _LoadFile(inputfile):
     """
-    Converts the input file into a list. The data has to be in a format other than
-    handling line by line (using next()).
+    Load the input file as a _LineIndex. The file is memory mapped and only the offsets of
+    each line are held, the lines themselves are read from the map when indexed. A file
+    compressed with gzip, bzip2 or xz can't be mapped, it is decompressed in chunks and
+    split into a list of lines as it is read, see _SplitLines.
 
-    The function for processing the file reads section by section rather than line
-    by line. This may be an inefficient method but the input file should not be very
-    large so it should not require a large amount of memory.
+    The returned object can be indexed, sliced and iterated like a list of the lines with
+    any carriage returns (both Mac and Unix) removed.
     """
     if inputfile == '':
         raise IOError('No file name supplied.')
-    flist = []
-    infile = open(inputfile)
-    # Loop over lines and remove any carriage returns (both Mac and Unix)
-    for line in infile:
-        cleanline = line.rstrip('\r\n')
-        flist.append(cleanline)
-    infile.close()
-    return flist
+    if _Decompressor(inputfile) is not None:
+        with _OpenFile(inputfile) as infile:
+            return list(_SplitLines(infile))
+    return _LineIndex(inputfile)
+
+
+def _SplitLines(infile, head=''):
+    """
+    Generator of the lines of an open file read in chunks, after the text head already read
+    from it. As for _LoadFile, the newline and any trailing carriage returns are removed.
+    """
+    pending = ''
+    for chunk in _itertools.chain([head], iter(lambda: infile.read(_Sniffer._chunkSize), '')):
+        lines = (pending + chunk).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line.rstrip('\r')
+    if pending:
+        yield pending.rstrip('\r')
+
+
+class _LineIndex:
+    """
+    Memory mapped uncompressed file with arrays of the start and end byte offsets of each
+    line. The end offsets exclude the newline and any trailing carriage returns.
+    """
+    _chunkSize = 1 << 24  # bytes searched for newlines at a time
+
+    def __init__(self, inputfile, infile=None):
+        """
+        infile, if given, is inputfile opened for reading, it is not closed.
+        """
+        opened = infile is None
+        if opened:
+            infile = open(inputfile, 'rb')
+        try:
+            self._data, size = self._map(infile)
+        finally:
+            if opened:
+                infile.close()
+        self.starts, self.ends = self._indexLines(size)
+
+    @staticmethod
+    def _map(infile):
+        """
+        Memory map an open file, '' if it is empty. Returns the map and the size of the file.
+        """
+        size = _os.fstat(infile.fileno()).st_size
+        if size == 0:
+            return '', 0
+        return _mmap.mmap(infile.fileno(), 0, access=_mmap.ACCESS_READ), size
+
+    def _indexLines(self, size):
+        buf = self.Bytes()
+        newlines = [_np.zeros(0, dtype=_np.int64)]
+        for chunkStart in xrange(0, size, self._chunkSize):
+            chunk = buf[chunkStart:chunkStart + self._chunkSize]
+            newlines.append(_np.flatnonzero(chunk == ord('\n')).astype(_np.int64) + chunkStart)
+        ends = _np.concatenate(newlines)
+        starts = _np.concatenate(([0], ends + 1)).astype(_np.int64)
+        if size > 0 and (len(ends) == 0 or ends[-1] != size - 1):
+            ends = _np.concatenate((ends, [size])).astype(_np.int64)  # last line without a newline
+        else:
+            starts = starts[:-1]
+        # strip carriage returns before the newline
+        stripping = _np.flatnonzero(ends > starts)
+        while len(stripping) > 0:
+            stripping = stripping[buf[ends[stripping] - 1] == ord('\r')]
+            ends[stripping] -= 1
+            stripping = stripping[ends[stripping] > starts[stripping]]
+        return starts, ends
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return _Lines(self, _np.arange(*index.indices(len(self))))
+        return self._data[self.starts[index]:self.ends[index]]
+
+    def __iter__(self):
+        for start, end in zip(self.starts, self.ends):
+            yield self._data[start:end]
+
+    def Take(self, rows):
+        """
+        The lines with the given line numbers as a list of strings.
+        """
+        data = self._data
+        return [data[start:end] for start, end in zip(self.starts[rows].tolist(), self.ends[rows].tolist())]
+
+    def Find(self, substrings):
+        """
+        Return the sorted line numbers of the lines containing any of the substrings.
+        """
+        # mmap.find compares byte by byte, so the file is searched as string chunks that
+        # overlap by the longest substring
+        if len(self) == 0:
+            return _np.zeros(0, dtype=_np.int64)
+        offsets = []
+        overlap = max(len(substring) for substring in substrings) - 1
+        begin, end = int(self.starts[0]), int(self.ends[-1])
+        for chunkStart in xrange(begin, end, self._chunkSize):
+            chunk = self._data[chunkStart:min(chunkStart + self._chunkSize + overlap, end)]
+            for substring in substrings:
+                pos = chunk.find(substring)
+                while pos != -1:
+                    if pos < self._chunkSize:  # else found again in the next chunk
+                        offsets.append(chunkStart + pos)
+                    pos = chunk.find(substring, pos + 1)
+        linenums = _np.searchsorted(self.starts, offsets, side='right') - 1
+        return _np.unique(linenums)
+
+    def Chunk(self, rows):
+        """
+        The lines rows (in increasing order) as a _LineIndex holding a copy of only the bytes
+        they span, which can be sent to another process.
+        """
+        chunk = _copy.copy(self)
+        begin = int(self.starts[rows[0]]) if len(rows) else 0
+        end = int(self.ends[rows[-1]]) if len(rows) else 0
+        chunk._data = self._data[begin:end]
+        chunk.starts = self.starts[rows] - begin
+        chunk.ends = self.ends[rows] - begin
+        return chunk
+
+    def Section(self, start, stop):
+        """
+        The lines start to stop as a _LineIndex sharing the data of this one, with the
+        line numbers counted from start.
+        """
+        section = _copy.copy(self)
+        section.starts = self.starts[start:stop]
+        section.ends = self.ends[start:stop]
+        return section
+
+    def Bytes(self):
+        """
+        The file contents as a uint8 array (no copy is made).
+        """
+        if len(self._data) == 0:
+            return _np.zeros(0, dtype=_np.uint8)
+        return _np.frombuffer(self._data, dtype=_np.uint8)
+
+
+class _Lines:
+    """
+    A sequence of lines of a _LineIndex given by an array of line numbers. Slicing returns
+    another _Lines sharing the same array, so no lines are copied.
+    """
+    __slots__ = ('index', 'rows')
+
+    def __init__(self, index, rows):
+        self.index = index
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return _Lines(self.index, self.rows[item])
+        return self.index[self.rows[item]]
+
+    def __iter__(self):
+        for row in self.rows:
+            yield self.index[row]
 
 
 def _updateElementLine(line):
@@ -741,21 +2822,246 @@ def _updateElementLine(line):
     return newline
 
 
-def _GetElementData(index, dataDict):
-    # Function to get the data for each element, rather than each key.
-    elementlist = [dataDict[keyName][index] for keyName in dataDict.keys()]
+# first columns of the six 10 character fields of a *TRANSFORM* matrix row
+_transformFieldStarts = [11, 21, 31, 41, 51, 61]
+
+
+def _SetDispersion(records, rows):
+    """
+    Set Disp_x and Disp_y of the records of multi line output to the last fields of the first
+    and third *TRANSFORM 1* rows of each, in rows, decoded at once with _FortranFields. A field
+    that cannot be read is 0. Returns the records.
+    """
+    values, valid = _FortranFields(rows, _transformFieldStarts[5:], 10)
+    for record, (dx, dy) in zip(records, values.reshape(len(records), 2).tolist()):
+        record['Disp_x'] = dx
+        record['Disp_y'] = dy
+    return records
+
+
+def _SplitElements(output, ranges):
+    """
+    Split the list of all element data into their individual elements, given the line
+    ranges of the elements from _ElementRanges. A line starting with '*' (other than a
+    *TRANSFORM* line) or '0POSITION' starts a new element. An 'IO' message at the end of
+    an element is appended to the list on its own.
+    """
+    elementlist = []
+    for start, stop in ranges:
+        elementlist.extend(_ElementEntries(output[start:stop]))
     return elementlist
 
-def _GetTransformLineElements(line):
-    elements = []
-    for element in range(6):
-        start = ((element + 1) * 10 + 1)
-        end = start + 10
-        eleVal = _remove_blanks(line[start:end].split(' '))[0]
-        try:
-            elements.append(_np.float(eleVal))
-        except ValueError:
-            elements.append(0)
-    return elements
+
+def _IterElements(lines, numLines, markLast=False):
+    """
+    Generator of the elements of _SplitElements from an iterator over the numLines lines
+    of the optics output (None if not known, see _LineEvents for markLast). Only the lines
+    from the start of the current element are kept.
+    """
+    buffered = []
+    bufferStart = 0  # line number of buffered[0]
+
+    def bufferedLines():
+        for line in lines:
+            buffered.append(line)
+            yield line
+
+    for start, stop in _ElementRanges(_LineEvents(bufferedLines(), numLines, markLast)):
+        for entry in _ElementEntries(buffered[start - bufferStart:stop - bufferStart]):
+            yield entry
+        del buffered[:start - bufferStart]
+        bufferStart = start
+
+
+def _ElementEntries(element):
+    """
+    The entries of the element list for an element: the element itself, followed by
+    an 'IO' message at its end as a separate entry.
+    """
+    if element[-1][:2] == 'IO':
+        return [element[:-1], element[-1]]
+    return [element]
 
 
+def _ElementEvents(output):
+    """
+    The lines of the output that can start or end an element, as (linenum, isHeader, isLast).
+    These are the header lines, the first line and the last line. Lines shorter than two
+    characters never start or end an element.
+    """
+    if isinstance(output, _Lines):
+        return _ElementEventsIndexed(output)
+    return list(_LineEvents(output, len(output)))
+
+
+def _LineEvents(lines, numLines, markLast=False):
+    """
+    Generator of the events of _ElementEvents from an iterator over the numLines lines.
+    If numLines is None the last line is not known, so the element open at the end is not
+    given, unless markLast is set, in which case the last line is found by reading one ahead.
+    """
+    lastline = None if numLines is None else numLines - 1
+    if markLast:
+        lines = _MarkLast(lines)
+    else:
+        lines = ((line, False) for line in lines)
+    first = True
+    for linenum, (line, isLastLine) in enumerate(lines):
+        if len(line) < 2:
+            continue
+        isLast = isLastLine or linenum == lastline
+        isHeader = _IsElementHeader(line)
+        if isHeader or first or isLast:
+            yield linenum, isHeader, isLast
+        first = False
+
+
+def _MarkLast(lines):
+    """
+    Generator of (line, isLast) for the lines of an iterator, reading one line ahead.
+    """
+    previous = None
+    for line in lines:
+        if previous is not None:
+            yield previous, False
+        previous = line
+    if previous is not None:
+        yield previous, True
+
+
+def _ElementEventsIndexed(output):
+    """
+    _ElementEvents for lines of a memory mapped file, classified from the line offsets.
+    """
+    buf = output.index.Bytes()
+    starts = output.index.starts[output.rows]
+    lengths = output.index.ends[output.rows] - starts
+    ok = _np.flatnonzero(lengths >= 2)
+    if len(ok) == 0:
+        return []
+    candidates = ok[(buf[starts[ok] + 1] == ord('*')) | (buf[starts[ok]] == ord('0'))]
+    isHeader = _np.zeros(len(output), dtype=bool)
+    for linenum in candidates:
+        isHeader[linenum] = _IsElementHeader(output[linenum])
+    lastline = len(output) - 1
+    linenums = _np.union1d(_np.flatnonzero(isHeader), [ok[0]])
+    if ok[-1] == lastline:
+        linenums = _np.union1d(linenums, [lastline])
+    return [(linenum, isHeader[linenum], linenum == lastline) for linenum in linenums]
+
+
+def _IsElementHeader(line):
+    """
+    Whether a line (at least two characters long) of the optics output starts an element.
+    """
+    return _LineKind(line) == _kindHeader  # TRANSFORM is midway through element output
+
+
+def _IsElementStart(line):
+    """
+    Whether a line of the optics output after the first starts an element.
+    """
+    return len(line) >= 2 and _IsElementHeader(line)
+
+
+def _NextElementStart(lines, linenum):
+    """
+    The line after the element starting at line linenum of the optics output: the next line
+    that starts an element, or the end of the lines.
+    """
+    for stop in xrange(linenum + 1, len(lines)):
+        if _IsElementStart(lines[stop]):
+            return stop
+    return len(lines)
+
+
+def _ElementRangesBackwards(lines):
+    """
+    Generator of the ranges of _ElementRanges(_ElementEvents(lines)) from the last to the first,
+    reading the lines backwards from the end only as far as the ranges are taken.
+    """
+    numLines = len(lines)
+    starts = _ElementStartsBackwards(lines, numLines)
+    stop = next(starts, None)
+    if stop is None:
+        return
+    if len(lines[numLines - 1]) >= 2:  # else the element open at the end is not given
+        if stop == numLines - 1 and not _IsElementHeader(lines[stop]):
+            return  # the only line that starts an element is the last, which isn't a header
+        if stop == numLines - 1:
+            # a header on the last line is given with the element before it and on its own
+            start = next(starts, None)
+            if start is None:
+                yield stop, numLines
+                return
+            yield start, stop
+            yield start, numLines
+            stop = start
+        else:
+            yield stop, numLines
+    for start in starts:
+        yield start, stop
+        stop = start
+
+
+def _ElementStartsBackwards(lines, stop):
+    """
+    Generator of the line numbers before stop that start an element in _ElementRanges, from the
+    last: the headers, and the first line at least two characters long.
+    """
+    firstHeader = None
+    for linenum in _HeaderCandidatesBackwards(lines, stop):
+        line = lines[linenum]
+        if len(line) >= 2 and _IsElementHeader(line):
+            firstHeader = linenum
+            yield linenum
+    for linenum in xrange(stop):
+        if len(lines[linenum]) >= 2:
+            if linenum != firstHeader:
+                yield linenum
+            return
+
+
+def _HeaderCandidatesBackwards(lines, stop):
+    """
+    Generator of the line numbers before stop, from the last, of the lines that may be element
+    headers. For lines of a memory mapped file only the lines starting with '0' or with '*'
+    as their second character are given, found a block of lines at a time.
+    """
+    if not isinstance(lines, _Lines):
+        for linenum in xrange(stop - 1, -1, -1):
+            yield linenum
+        return
+    buf = lines.index.Bytes()
+    blockSize = 1024
+    for blockStop in xrange(stop, 0, -blockSize):
+        blockStart = max(blockStop - blockSize, 0)
+        starts = lines.index.starts[lines.rows[blockStart:blockStop]]
+        lengths = lines.index.ends[lines.rows[blockStart:blockStop]] - starts
+        longLines = _np.flatnonzero(lengths >= 2)
+        candidates = longLines[(buf[starts[longLines] + 1] == ord('*')) | (buf[starts[longLines]] == ord('0'))]
+        for linenum in candidates[::-1].tolist():
+            yield blockStart + linenum
+
+
+def _ElementRanges(events):
+    """
+    Generator of the (start, stop) line ranges of the elements from the events given by _ElementEvents.
+    The first line always starts an element and each header line ends the current element and
+    starts the next one. The element still open at the last line is included up to the end.
+    """
+    start = None
+    for linenum, isHeader, isLast in events:
+        end = None
+        if isHeader:
+            if start is None:       # Current line must be start of the element
+                start = linenum
+            else:
+                end = linenum       # Otherwise the line must be the start of the next element
+        if start is not None and isLast:
+            yield start, linenum + 1
+        if end is not None:         # If the start and end of the element are found, yield and reset
+            yield start, end
+            start = None
+        if start is None:           # Though if it's been reset, it must be because the current
+            start = linenum         # line is the start of next element
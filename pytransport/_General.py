@@ -18,6 +18,7 @@ import string as _string
 import glob as _glob
 
 import Reader as _Reader
+from Data import _OpenFile
 from Data import _beamprops
 from Data import ConversionData
 
@@ -163,22 +164,17 @@ def CheckIsOutput(inputfile):
          "0  XXX"
     
     being present, which represents the TRANSPORT indicator card line.
-    X can be 0, 1, 2. Default is 0.
+    X can be 0, 1, 2. Default is 0. The file can be compressed with gzip, bzip2 or xz.
+    The file is searched in chunks for the marker lines, up to the first indicator line.
     """
-    temp = _Reader.Reader()
-    isOutput = False
+    sniffer = _Reader._Sniffer(inputfile)
     try:
-        f = open(inputfile)
-        for inputline in f:
-            inputline = inputline.replace("\r", '')
-            inputline = inputline.replace("\n", '')
-            if inputline in temp._allowedIndicatorLines:
-                isOutput = True
-                break
+        f = _OpenFile(inputfile)
+        sniffer.Search(f, None, lambda s: s.indicatorLine is not None)
         f.close()
     except IOError:
         raise IOError('Cannot open file.')
-    return isOutput
+    return sniffer.indicatorLine is not None
 
 
 def CheckIsSentinel(line):
@@ -193,14 +189,12 @@ def CheckSingleLineOutputApplied(inputfile):
     Function to check if the control element that print element output in
     a single line was successfully applied. Check needed as not all versions
     of TRANSPORT can run this type code.
+
+    The inputfile can be a file name or an output file loaded with pytransport.Reader.Reader.Load,
+    in which case the already segmented optics are used.
     """
-    reader = _Reader.Reader()
-    flist = _Reader._LoadFile(inputfile)
-    optics = reader.optics._getOptics(flist, inputfile)
-    for element in optics:
-        if element == 'IO: UNDEFINED TYPE CODE 13. 19. ;':
-            return True
-    return False
+    output = _Reader._OpenOutput(inputfile)
+    return output.SingleLineOutputApplied()
 
 
 def ConvertBunchLength(transport, bunch_length):
@@ -422,7 +416,7 @@ def GetTypeNum(line):
 def JoinSplitLines(linenum, lattice):
     firstline = lattice[linenum].replace(';', '')
     latticeline = firstline  # Copy for later
-    firstline = _np.array(firstline.split(' '), dtype=_np.str)
+    firstline = _np.array(_Reader._Tokens(firstline), dtype=_np.str)
     firstline = RemoveIllegals(firstline)
     numericals = []
     nonnumericals = []
@@ -439,7 +433,7 @@ def JoinSplitLines(linenum, lattice):
     numelements = len(numericals) - 1
 
     secline = lattice[linenum + 1].replace(';', '')
-    secline = _np.array(secline.split(' '), dtype=_np.str)
+    secline = _np.array(_Reader._Tokens(secline), dtype=_np.str)
     secline = RemoveIllegals(secline)
     secnumericals = []
 
@@ -480,7 +474,7 @@ def OutputFitsToRegistry(transport, outputdata):
         linedict = {'elementnum': 0.0,
                     'name': '',
                     'length': 0.0}
-        data = RemoveIllegals(line.split(' '))
+        data = RemoveIllegals(_Reader._Tokens(line))
         eledata = GetElementData(data)
         label = GetLabel(data)
         if data[0] in isLegal:
@@ -516,7 +510,7 @@ def ProcessFits(fits):  # redundant
             section = fits[fitsstarts[secnum]:]
         lines = []
         for line in section:
-            lines.append(RemoveIllegals(line.split(' ')))
+            lines.append(RemoveIllegals(_Reader._Tokens(line)))
         fitsections.append(lines)
 
     magnetlines = []
@@ -586,6 +580,64 @@ def ScaleToMeters(transport, quantity):
     return conversionFactor
 
 
+def TwissFromSigma(sigx, sigxp, sigy, sigyp, r21, r43):
+    """
+    Function to calculate the Twiss parameters from the beam sigma matrix of any number of elements.
+    The arguments are arrays of the horizontal and vertical beam sizes and divergences, and the
+    correlations r21 and r43, with one entry per element.
+
+    Returns a dict of numpy arrays with keys Emitt_x, Emitt_y, Beta_x, Beta_y, Gamma_x, Gamma_y,
+    Alpha_x and Alpha_y. The emittance is in the product of the units of the sizes and divergences.
+
+    A correlation of exactly +/-1 is moved 1e-4 towards zero, as the output rounds it to one which
+    would produce a div by zero. A zero emittance gives an undefined beta and gamma; any that are
+    nan are set to 0. Alpha is taken as the positive root, with alpha^2 < 0 set to 0.
+    """
+    sigx  = _np.asarray(sigx, dtype=_np.float64)
+    sigxp = _np.asarray(sigxp, dtype=_np.float64)
+    sigy  = _np.asarray(sigy, dtype=_np.float64)
+    sigyp = _np.asarray(sigyp, dtype=_np.float64)
+    r21   = _np.array(r21, dtype=_np.float64)
+    r43   = _np.array(r43, dtype=_np.float64)
+
+    for r in [r21, r43]:
+        r[r == 1.0] -= 1e-4
+        r[r == -1.0] += 1e-4
+
+    # _np.power rather than ** so the squares are computed with pow() as for python floats
+    with _np.errstate(divide='ignore', invalid='ignore'):
+        xpint = _np.sqrt(_np.power(sigxp, 2) * (1 - _np.power(r21, 2)))
+        ypint = _np.sqrt(_np.power(sigyp, 2) * (1 - _np.power(r43, 2)))
+
+        ex = sigx * xpint
+        ey = sigy * ypint
+
+        betx   = _np.power(sigx, 2) / ex
+        gammax = _np.power(sigxp, 2) / ex
+        bety   = _np.power(sigy, 2) / ey
+        gammay = _np.power(sigyp, 2) / ey
+
+        for twiss in [betx, bety, gammax, gammay]:
+            twiss[_np.isnan(twiss)] = 0
+
+        alfx2 = (gammax * betx) - 1.0
+        alfy2 = (gammay * bety) - 1.0
+        alfx2[alfx2 < 0] = 0
+        alfy2[alfy2 < 0] = 0
+
+        alfx = _np.sqrt(alfx2)
+        alfy = _np.sqrt(alfy2)
+
+    return {'Emitt_x': ex,
+            'Emitt_y': ey,
+            'Beta_x' : betx,
+            'Beta_y' : bety,
+            'Gamma_x': gammax,
+            'Gamma_y': gammay,
+            'Alpha_x': alfx,
+            'Alpha_y': alfy}
+
+
 def UpdateEnergyFromMomentum(transport, momentum):
     """
     Function to calculate (from momentum):
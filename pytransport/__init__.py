@@ -13,4 +13,5 @@ Copyright Royal Holloway, University of London 2017.
 import _General
 import Elements
 import Reader
-import Data
\ No newline at end of file
+import Data
+import Cache
\ No newline at end of file
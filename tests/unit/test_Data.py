@@ -0,0 +1,158 @@
+import collections
+import copy
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from pytransport import Data
+from pytransport.Cache import _Encode
+
+
+class TestEmptyBDSData(unittest.TestCase):
+    def setUp(self):
+        self.data = Data.BDSData()
+        self.data._AddProperty('S', 'm')
+        self.data._AddProperty('Name')
+
+    def test_rows(self):
+        self.assertEqual(list(self.data), [])
+        self.assertEqual(len(self.data), 0)
+        self.assertRaises(IndexError, self.data.GetItemTuple, 0)
+
+    def test_columns(self):
+        self.assertEqual(len(self.data.GetColumn('S')), 0)
+        self.assertEqual(len(self.data.Name()), 0)
+
+    def test_encode(self):
+        arrays = _Encode(self.data)
+        self.assertEqual(len(arrays['column0']), 0)
+
+    def test_histogram_without_rows(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'empty.hist')
+            with open(filename, 'w') as f:
+                f.write('# histogram\nlower[m] upper[m] value[NA]\nunderflow 0\noverflow 0\n')
+            data = Data._Load(filename)
+            self.assertEqual(data.names, ['lower', 'upper', 'value'])
+            self.assertEqual(list(data), [])
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestBDSData(unittest.TestCase):
+    def setUp(self):
+        self.data = Data.BDSData()
+        self.data._AddProperty('S', 'm')
+        self.data._AddProperty('Name')
+        self.data.extend([(0.5 * i, 'E%d' % i) for i in range(10)])
+
+    def test_rows(self):
+        self.assertEqual(self.data.GetItemTuple(2), (1.0, 'E2'))
+        self.assertEqual(self.data[3], {'S': 1.5, 'Name': 'E3'})
+        self.assertEqual(list(self.data)[-1], (4.5, 'E9'))
+
+    def test_slice_shares_columns(self):
+        view = self.data[2:8:2]
+        self.assertEqual(list(view.S()), [1.0, 2.0, 3.0])
+        self.assertTrue(np.shares_memory(view.S(), self.data.S()))
+        view.append((99.0, 'X'))
+        self.assertEqual(len(self.data), 10)
+        self.assertEqual(self.data.S()[5], 2.5)
+
+    def test_sequence(self):
+        self.assertIsInstance(self.data, collections.Sequence)
+        self.assertNotIsInstance(self.data, list)
+        self.assertIn((1.0, 'E2'), self.data)
+        self.assertIn(self.data[2], self.data)
+        self.assertEqual(self.data.index((1.5, 'E3')), 3)
+        self.assertEqual(self.data.count((1.5, 'E3')), 1)
+        self.assertEqual(list(reversed(self.data))[0], (4.5, 'E9'))
+
+    def test_append_checks_row_length(self):
+        self.assertRaises(ValueError, self.data.append, (1.0,))
+        self.assertRaises(ValueError, self.data.extend, [(1.0, 'A'), (2.0,)])
+        self.assertEqual(len(self.data), 10)
+        self.assertEqual(self.data.GetItemTuple(-1), (4.5, 'E9'))
+
+    def test_copy(self):
+        for copied in (copy.copy(self.data), copy.deepcopy(self.data)):
+            copied.append((99.0, 'X'))
+            self.assertEqual(len(self.data), 10)
+            self.assertEqual(len(copied), 11)
+            self.assertEqual(copied.S()[-1], 99.0)
+            self.assertEqual(self.data.S()[-1], 4.5)
+            self.assertEqual(copied.names, self.data.names)
+            self.assertIsNot(copied.names, self.data.names)
+
+
+class TestWhere(unittest.TestCase):
+    def setUp(self):
+        self.data = Data.BDSData()
+        self.data._AddProperty('S', 'm')
+        self.data._AddProperty('Name')
+        self.data._AddProperty('Type')
+        types = ['DRIFT', 'QUAD', 'BEND']
+        self.data.extend([(0.5 * i, 'E%d' % i, types[i % 3]) for i in range(10)])
+
+    def names(self, condition):
+        return list(self.data.Select(condition).Name())
+
+    def test_range(self):
+        self.assertEqual(self.names(Data.Where.Range('S', 1.0, 2.0)), ['E2', 'E3', 'E4'])
+        self.assertEqual(self.names(Data.Where.Range('S', low=4.0)), ['E8', 'E9'])
+        self.assertEqual(self.names(Data.Where.Range('S', high=0.5)), ['E0', 'E1'])
+        self.assertEqual(len(self.names(Data.Where.Range('S'))), 10)
+
+    def test_near(self):
+        self.assertEqual(self.names(Data.Where.Near('S', 1.0, 0.5)), ['E1', 'E2', 'E3'])
+        self.assertEqual(self.names(Data.Where.Near('S', 1.0, 0.0)), ['E2'])
+        self.assertEqual(self.names(Data.Where.Near('S', 1.2, 0.2)), ['E2'])
+        self.assertEqual(self.names(Data.Where.Near('S', 1.25, 0.2)), [])
+
+    def test_in(self):
+        self.assertEqual(self.names(Data.Where.In('Type', ['BEND'])), ['E2', 'E5', 'E8'])
+        self.assertEqual(self.names(Data.Where.In('Type', set(['BEND', 'QUAD']))),
+                         ['E1', 'E2', 'E4', 'E5', 'E7', 'E8'])
+        self.assertEqual(self.names(Data.Where.In('Type', [])), [])
+
+    def test_matches(self):
+        self.assertEqual(self.names(Data.Where.Matches('Type', 'Q*')), ['E1', 'E4', 'E7'])
+        self.assertEqual(self.names(Data.Where.Matches('Name', 'E[13]')), ['E1', 'E3'])
+        self.assertEqual(self.names(Data.Where.Matches('Type', 'quad')), [])
+
+    def test_combinations(self):
+        quads = Data.Where.In('Type', ['QUAD'])
+        start = Data.Where.Range('S', high=2.0)
+        self.assertEqual(self.names(quads & start), ['E1', 'E4'])
+        self.assertEqual(self.names(quads | start), ['E0', 'E1', 'E2', 'E3', 'E4', 'E7'])
+        self.assertEqual(self.names(~quads & ~start), ['E5', 'E6', 'E8', 'E9'])
+        self.assertEqual(self.names(~(quads | start)), ['E5', 'E6', 'E8', 'E9'])
+
+    def test_mask_and_indices(self):
+        condition = Data.Where.Matches('Type', 'D*')
+        self.assertEqual(self.data.Mask(condition).tolist(), [i % 3 == 0 for i in range(10)])
+        self.assertEqual(self.data.Indices(condition).tolist(), [0, 3, 6, 9])
+        self.assertEqual(len(self.data.Select(Data.Where.In('Type', ['X']))), 0)
+
+    def test_match_value(self):
+        # the rows of the loop the selection replaced
+        for value, tolerance in [(1.0, 0.5), (1.0, 0.0), (1.2, 0.2), (1.25, 0.2), (10.0, 1.0)]:
+            expected = [row for row in self.data if abs(row[0] - value) <= tolerance]
+            matched = self.data.MatchValue('S', value, tolerance)
+            self.assertEqual(list(matched), expected)
+            self.assertEqual(matched.names, self.data.names)
+
+    def test_filter(self):
+        flags = [i % 4 == 1 for i in range(10)]
+        filtered = self.data.Filter(flags)
+        self.assertEqual(list(filtered), [row for row, flag in zip(self.data, flags) if flag])
+        self.assertEqual(list(self.data.Filter(np.array(flags, dtype=int))), list(filtered))
+        self.assertEqual(len(self.data.Filter([False] * 10)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
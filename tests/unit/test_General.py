@@ -0,0 +1,41 @@
+import unittest
+
+import numpy as np
+
+from pytransport import _General
+
+
+class TestTwissFromSigma(unittest.TestCase):
+    def test_sigma_matrix(self):
+        # sigma = emittance * [[beta, -alpha], [-alpha, gamma]]
+        sigma = np.array([[4.0, -3.6], [-3.6, 9.0]])
+        emittance = np.sqrt(np.linalg.det(sigma))
+        sigx, sigxp = np.sqrt(np.diag(sigma))
+        r21 = sigma[1, 0] / (sigx * sigxp)
+        twiss = _General.TwissFromSigma([sigx], [sigxp], [sigx], [sigxp], [r21], [-r21])
+        for plane in ('x', 'y'):
+            self.assertAlmostEqual(twiss['Emitt_' + plane][0], 4.8)
+            self.assertAlmostEqual(twiss['Emitt_' + plane][0], emittance)
+            self.assertAlmostEqual(twiss['Beta_' + plane][0], sigma[0, 0] / emittance)
+            self.assertAlmostEqual(twiss['Gamma_' + plane][0], sigma[1, 1] / emittance)
+            self.assertAlmostEqual(twiss['Alpha_' + plane][0], abs(sigma[1, 0]) / emittance)
+
+    def test_zero_emittance(self):
+        twiss = _General.TwissFromSigma([2.0, 2.0], [3.0, 3.0], [0.0, 1.0], [0.0, 1.0], [0.6, 0.6], [0.0, 0.0])
+        self.assertEqual(twiss['Emitt_y'].tolist(), [0.0, 1.0])
+        for name in ('Beta_y', 'Gamma_y', 'Alpha_y'):
+            self.assertEqual(twiss[name][0], 0.0)
+        self.assertEqual(twiss['Beta_y'][1], 1.0)
+        self.assertAlmostEqual(twiss['Beta_x'][0], 4.0 / 4.8)
+        self.assertAlmostEqual(twiss['Alpha_x'][1], 0.75)
+
+    def test_unit_correlation(self):
+        twiss = _General.TwissFromSigma([1.0, 1.0], [1.0, 1.0], [1.0, 1.0], [1.0, 1.0], [1.0, -1.0], [0.5, 0.5])
+        emittance = np.sqrt(1 - (1 - 1e-4) ** 2)
+        self.assertEqual(twiss['Emitt_x'].tolist(), [emittance, emittance])
+        self.assertTrue(np.isfinite(twiss['Beta_x']).all())
+        self.assertAlmostEqual(twiss['Alpha_x'][0], (1 - 1e-4) / emittance)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,488 @@
+import gzip
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+from pytransport import Reader
+from pytransport.Cache import OutputCache
+
+_dataDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+_standard = os.path.join(_dataDir, 'standard.dat')
+_singleLine = os.path.join(_dataDir, 'single.dat')
+_beam = os.path.join(_dataDir, 'beam.dat')
+_multi = os.path.join(_dataDir, 'multi.dat')
+
+
+def _Lines(filename):
+    with open(filename) as f:
+        return f.read().split('\n')
+
+
+class _TempDirTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.reader = Reader.Reader()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write(self, name, lines):
+        filename = os.path.join(self.directory, name)
+        with open(filename, 'w') as f:
+            f.write('\n'.join(lines))
+        return filename
+
+
+class TestProblems(_TempDirTest):
+    def test_fit_indicator_starts_problem(self):
+        lines = _Lines(_standard)
+        second = ['0    1' if line == '0    0' else line for line in lines]
+        filename = self._write('problems.dat', lines + second)
+        problems = self.reader.Problems(filename)
+        self.assertEqual(len(problems), 2)
+        expected = self.reader.GetOptics(_standard)
+        self.assertEqual(list(problems[1].Optics().S()), list(expected.S()))
+
+    def test_indexed_once(self):
+        filename = self._write('problems.dat', _Lines(_standard) * 2)
+        problem = self.reader.Problem(filename, 1)
+        self.assertIs(self.reader.Problem(filename, 1), problem)
+        self.assertIs(self.reader.Problems(filename)[1], problem)
+        self.assertIs(problem._reader, self.reader)
+
+    def test_indexed_bounded(self):
+        count = Reader.Reader._indexedFiles + 1
+        filenames = [self._write('problems%d.dat' % i, _Lines(_standard)) for i in range(count)]
+        first = self.reader.Problem(filenames[0], 0)
+        for filename in filenames[1:]:
+            self.reader.Problems(filename)
+        self.assertEqual(len(self.reader._indexed), Reader.Reader._indexedFiles)
+        self.assertIsNot(self.reader.Problem(filenames[0], 0), first)
+        # the file used last is kept
+        last = self.reader.Problem(filenames[-1], 0)
+        self.reader.Problems(filenames[1])
+        self.assertIs(self.reader.Problem(filenames[-1], 0), last)
+
+
+class TestFormat(_TempDirTest):
+    def _compress(self, filename):
+        compressed = os.path.join(self.directory, os.path.basename(filename) + '.gz')
+        with gzip.open(compressed, 'wb') as f:
+            f.write('\n'.join(_Lines(filename)))
+        return compressed
+
+    def test_compressed(self):
+        filename = self._compress(_standard)
+        self.assertEqual(repr(list(self.reader.GetOptics(filename))),
+                         repr(list(self.reader.GetOptics(_standard))))
+
+    def test_compressed_single_line(self):
+        filename = self._compress(_singleLine)
+        for inputType in (None, 'standard'):
+            optics, matrices = self.reader.GetOptics(filename, inputType, matrices=['Sigma'])
+            expected, expectedMatrices = self.reader.GetOptics(_singleLine, inputType, matrices=['Sigma'])
+            self.assertEqual(repr(list(optics)), repr(list(expected)))
+            self.assertEqual(repr(matrices['Sigma'].tolist()), repr(expectedMatrices['Sigma'].tolist()))
+
+    def test_compressed_lines(self):
+        output = self.reader.Load(self._compress(_standard))
+        self.assertEqual(list(output.lines), list(self.reader.Load(_standard).lines))
+
+    def test_indicator_after_bound(self):
+        lines = ['x' * 99] * (Reader._Sniffer._maxBytes // 100 + 1) + _Lines(_standard)
+        filename = self._write('late.dat', lines)
+        expected = repr(list(self.reader.GetOptics(_standard)))
+        self.assertEqual(repr(list(self.reader.GetOptics(filename))), expected)
+        self.assertEqual(repr(list(self.reader.GetOptics(self._compress(filename)))), expected)
+        self.assertTrue(Reader._General.CheckIsOutput(filename))
+
+    def test_no_indicator(self):
+        filename = self._write('none.dat', ['x' * 99] * (Reader._Sniffer._maxBytes // 100 + 1))
+        for inputFile in (filename, self._compress(filename)):
+            self.assertRaises(IOError, self.reader.GetOptics, inputFile)
+            self.assertFalse(Reader._General.CheckIsOutput(inputFile))
+
+
+class TestFitResults(unittest.TestCase):
+    def test_types_with_spaces(self):
+        fits = ['0SENTINEL',
+                ' *QUAD*   5.0 "Q1" 0.500 M 10.000 KG 5.000 CM',
+                ' *Z ROT*   20.0 "ZR" 45.000',
+                ' *SP CH*   22.0 "SC" 1.000 2.000',
+                ' *AXIS SHIFT*   2.0 "AS" 0.100',
+                ' *FIT*   10.0 "F" 1.0 2.0 0.5 0.1']
+        parameters, constraints = Reader._ParseFits(fits)
+        self.assertEqual(list(parameters['type']), ['QUAD', 'Z ROT', 'SP CH', 'AXIS SHIFT'])
+        self.assertEqual(list(parameters['name']), ['Q1', 'ZR', 'SC', 'AS'])
+        self.assertEqual(list(parameters['code']), [5.0, 20.0, 22.0, 2.0])
+        self.assertEqual(list(parameters['values'][1][:1]), [45.0])
+        self.assertEqual(list(constraints['name']), ['F'])
+        self.assertEqual(list(constraints['target']), [0.5])
+
+
+class TestFortranNumbers(unittest.TestCase):
+    def test_forms(self):
+        values, valid = Reader._FortranNumbers(['  1.25', '-3.5E+02', '1.0-3', '-2.5-103', '1.5D-03', '2.0d2'])
+        self.assertTrue(valid.all())
+        self.assertEqual(values.tolist(), [1.25, -350.0, 1.0e-3, -2.5e-103, 1.5e-3, 200.0])
+
+    def test_invalid(self):
+        values, valid = Reader._FortranNumbers(['', '    ', '****', '**********', '1.2.3'])
+        self.assertFalse(valid.any())
+        self.assertEqual(values.tolist(), [0.0] * 5)
+
+    def test_decode_decimals(self):
+        texts = np.array([' 12.5 ', '-0.001', '1.5E-03', '1.0-3', '1.5D-03', '', '****'])
+        codes = texts.view(np.uint8).reshape(len(texts), texts.dtype.itemsize)
+        values, decoded = Reader._DecodeDecimals(codes)
+        self.assertEqual(decoded.tolist(), [True, True, True, False, False, False, False])
+        self.assertEqual(values[:3].tolist(), [12.5, -0.001, 1.5e-3])
+
+    def test_fields(self):
+        line = '          1' + '%10.5f' % 1.0 * 4 + '  -1.23456' + '  -1.0-103'
+        values, valid = Reader._FortranFields([line, ''], Reader._transformFieldStarts, 10)
+        self.assertEqual(values[0].tolist(), [1.0] * 4 + [-1.23456, -1.0e-103])
+        self.assertEqual(valid.tolist(), [[True] * 6, [False] * 6])
+
+
+class TestSecondOrderTerms(unittest.TestCase):
+    def _terms(self, rows):
+        element = [' *DRIFT*   3.0 "D1" 1.000 M'] + [''] * 6 + [' *TRANSFORM 2*'] + rows
+        collector = Reader._SecondOrderTerms()
+        collector.Add(element)
+        terms = collector.Array()
+        return dict(((i, j, k), value) for element, i, j, k, value in terms.tolist())
+
+    def test_short_tokens(self):
+        self.assertEqual(self._terms([' 1  11 5  12 7', '    66 2', ' 2  11 3']),
+                         {(0, 0, 0): 5.0, (0, 0, 1): 7.0, (0, 5, 5): 2.0, (1, 0, 0): 3.0})
+
+    def test_digit_values(self):
+        self.assertEqual(self._terms([' 1  11 12  16 5', ' 211 34  212 1.5E-01']),
+                         {(0, 0, 0): 12.0, (0, 0, 5): 5.0, (1, 0, 0): 34.0, (1, 0, 1): 0.15})
+
+
+class TestMatrices(unittest.TestCase):
+    def setUp(self):
+        self.reader = Reader.Reader()
+
+    def test_transfer(self):
+        optics, matrices = self.reader.GetOptics(_standard, matrices=['R'])
+        self.assertEqual(matrices['R'].shape, (len(optics), 6, 6))
+        self.assertEqual(matrices['R'][2, 0].tolist(), [3.17882, -3.31982, 5.39602, 0.00672, -6.74603, 8.63241])
+        self.assertEqual(matrices['R'][2, :, 5].tolist(), [8.63241, -8.09273, -2.9876, 8.42724, 8.56835, -5.75489])
+        optics, matrices = self.reader.GetOptics(_singleLine, matrices=['R'])
+        self.assertEqual(matrices['R'][0, 0, 0], -7.17647)
+        self.assertTrue(np.isnan(matrices['R'][1:]).all())
+
+    def test_sigma(self):
+        optics, matrices = self.reader.GetOptics(_standard, matrices=['Sigma'])
+        sigma = matrices['Sigma'][2]
+        self.assertAlmostEqual(sigma[0, 0], 2.768 ** 2)
+        self.assertAlmostEqual(sigma[1, 0], 0.635 * 2.768 * 4.276)
+        self.assertAlmostEqual(sigma[3, 2], 1.0 * 3.357 * 1.040)
+        self.assertAlmostEqual(sigma[5, 5], 0.147 ** 2)
+        self.assertEqual(sigma[4, 0], 0.0)
+        self.assertTrue(np.isnan(sigma[4, 1]))
+
+    def test_sigma_symmetric(self):
+        for filename in (_standard, _singleLine):
+            optics, matrices = self.reader.GetOptics(filename, matrices=['Sigma'])
+            sigma = matrices['Sigma']
+            self.assertEqual(sigma.shape, (len(optics), 6, 6))
+            self.assertEqual(repr(sigma), repr(sigma.transpose(0, 2, 1)))
+            self.assertTrue((sigma[:, range(6), range(6)] > 0).all())
+
+    def test_sigma_single_line(self):
+        optics, matrices = self.reader.GetOptics(_singleLine, matrices=['Sigma'])
+        self.assertEqual(optics.GetColumn('Name')[1], 'Z0')
+        sigma = matrices['Sigma'][1]
+        widths = [3.172, 4.829, 3.300, 1.079, 4.208, 0.275]
+        for i, width in enumerate(widths):
+            self.assertAlmostEqual(sigma[i, i], width ** 2)
+        self.assertAlmostEqual(sigma[1, 0], 0.687 * 3.172 * 4.829)
+        self.assertAlmostEqual(sigma[3, 2], 0.676 * 3.300 * 1.079)
+        self.assertTrue(np.isnan(sigma[2, 0]) and np.isnan(sigma[5, 4]))
+
+    def test_sigma_beam(self):
+        # the *BEAM* element is written to multiple lines before the single line elements
+        optics, matrices = self.reader.GetOptics(_singleLine, matrices=['Sigma'])
+        self.assertEqual(optics.GetColumn('Name')[0], 'BEAM')
+        sigma = matrices['Sigma'][0]
+        self.assertAlmostEqual(sigma[0, 0], 3.381 ** 2)
+        self.assertAlmostEqual(sigma[1, 0], 1.000 * 3.381 * 4.991)
+        self.assertAlmostEqual(sigma[3, 1], 0.200 * 4.991 * 4.596)
+        self.assertAlmostEqual(sigma[5, 5], 0.156 ** 2)
+        self.assertEqual(sigma[5, 0], 0.0)
+        self.assertTrue(np.isnan(sigma[5, 1]))
+
+    def test_dense_second_order(self):
+        collector = Reader._DenseSecondOrderTerms()
+        collector.blockSize = 2
+        header = [' *DRIFT*   3.0 "D1" 1.000 M'] + [''] * 6
+        collector.Add(header + [' *TRANSFORM 2*', ' 1  11 5  12 7'])
+        collector.Add(header)
+        collector.Add(header + [' *TRANSFORM 1*', ' *TRANSFORM 2*', ' 2  66 1.5E-01'])
+        terms = collector.Array()
+        self.assertEqual(terms.shape, (3, 6, 6, 6))
+        self.assertEqual(terms[0, 0, 0, :2].tolist(), [5.0, 7.0])
+        self.assertEqual(np.count_nonzero(terms[0]), 2)
+        self.assertTrue(np.isnan(terms[1]).all())
+        self.assertAlmostEqual(terms[2, 1, 5, 5], 0.15)
+        self.assertEqual(np.count_nonzero(terms[2]), 1)
+
+
+class TestDispersion(unittest.TestCase):
+    def setUp(self):
+        self.reader = Reader.Reader()
+
+    def assertDispersion(self, optics, expected):
+        self.assertEqual(zip(optics.GetColumn('Disp_x').tolist(), optics.GetColumn('Disp_y').tolist()), expected)
+
+    def test_multiple_lines(self):
+        # R16 and R36 from the *TRANSFORM 1* rows of each element, as the element loop read them
+        for filename in (_standard, _multi):
+            dispersion = {}
+            lines = _Lines(filename)
+            for linenum, line in enumerate(lines):
+                if line.startswith(' *') and not line.startswith(' *TRANSFORM'):
+                    name = line.split('"')[1]
+                elif line.startswith(' *TRANSFORM 1*'):
+                    dispersion[name] = (float(lines[linenum + 1].split()[6]), float(lines[linenum + 3].split()[6]))
+            optics = self.reader.GetOptics(filename)
+            self.assertDispersion(optics, [dispersion[name] for name in optics.GetColumn('Name').tolist()])
+
+    def test_single_line(self):
+        # the last matching row of the R matrix table, as the element loop found it
+        lines = _Lines(_singleLine)
+        start = [i for i, line in enumerate(lines) if line.startswith('0POSITION')][-1]
+        table = [line.split() for line in lines[start + 1:] if line.split()]
+        optics = self.reader.GetOptics(_singleLine)
+        expected = []
+        for s, name in zip(optics.GetColumn('S').tolist(), optics.GetColumn('Name').tolist()):
+            dx, dy = 0, 0
+            for row in table:
+                if float(row[1]) in [3, 4, 5] and float(row[0]) == s and row[2] == name:
+                    if row.index('*') == 4:
+                        dx, dy = float(row[15]), float(row[17])
+                    else:
+                        dx, dy = float(row[14]), float(row[16])
+            expected.append((dx, dy))
+        self.assertTrue(any(dx != 0 for dx, dy in expected))
+        self.assertDispersion(optics, expected)
+
+
+class TestColumnar(unittest.TestCase):
+    def test_same_as_rows(self):
+        reader = Reader.Reader()
+        for filename in (_standard, _singleLine, _multi, _beam):
+            optics = reader.GetOptics(filename)
+            columns = reader.GetOptics(filename, columnar=True)
+            self.assertEqual(list(columns.dtype.names), optics.names, filename)
+            self.assertEqual(len(columns), len(optics), filename)
+            for name in optics.names:
+                self.assertEqual(repr(columns[name].tolist()), repr(optics.GetColumn(name).tolist()), (filename, name))
+            for i in range(len(optics)):
+                self.assertEqual(repr(columns[i].tolist()), repr(optics.GetItemTuple(i)), (filename, i))
+
+
+class TestIterOptics(_TempDirTest):
+    def assertSameOptics(self, filename):
+        optics = self.reader.GetOptics(filename)
+        rows = list(self.reader.IterOptics(filename))
+        self.assertEqual(len(rows), len(optics))
+        for i, row in enumerate(rows):
+            self.assertEqual(repr(tuple(row[name] for name in optics.names)), repr(optics.GetItemTuple(i)))
+
+    def test_rows(self):
+        self.assertSameOptics(_standard)
+
+    def test_header_before_length(self):
+        lines = _Lines(_standard)
+        end = [i for i, line in enumerate(lines) if line.startswith('0*LENGTH*')][-1]
+        lines.insert(end, ' *FIT*   10.0 "F" 1.0 2.0')
+        self.assertSameOptics(self._write('fit.dat', lines))
+
+    def test_single_line(self):
+        # the beam is written to multiple lines before the flag, its dispersion is from the R matrix table
+        self.assertSameOptics(_singleLine)
+
+
+class TestOpticsAt(_TempDirTest):
+    def assertLastRow(self, filename):
+        optics = self.reader.GetOptics(filename)
+        at = self.reader.GetOpticsAt(filename, last=True)
+        self.assertEqual(len(at), 1)
+        self.assertEqual(repr(at.GetItemTuple(0)), repr(optics.GetItemTuple(len(optics) - 1)))
+
+    def test_last(self):
+        self.assertLastRow(_standard)
+
+    def test_last_before_header(self):
+        lines = _Lines(_standard)
+        end = [i for i, line in enumerate(lines) if line.startswith('0*LENGTH*')][-1]
+        lines.insert(end, ' *FIT*   10.0 "F" 1.0 2.0')
+        self.assertLastRow(self._write('fit.dat', lines))
+
+
+class TestParallel(unittest.TestCase):
+    # the momentum changes at several *ACC* elements, so most chunks start from a momentum read before them
+    def test_workers(self):
+        reader = Reader.Reader()
+        optics, matrices = reader.GetOptics(_multi, matrices=['R', 'Sigma'])
+        for workers in (2, 3):
+            chunked, chunkedMatrices = reader.GetOptics(_multi, workers=workers, matrices=['R', 'Sigma'])
+            self.assertEqual(chunked.names, optics.names)
+            for name in optics.names:
+                self.assertEqual(repr(chunked.GetColumn(name)), repr(optics.GetColumn(name)), (workers, name))
+            for name in matrices:
+                self.assertEqual(repr(chunkedMatrices[name]), repr(matrices[name]), (workers, name))
+
+
+class TestFollow(_TempDirTest):
+    def setUp(self):
+        _TempDirTest.setUp(self)
+        self.filename = os.path.join(self.directory, 'following.dat')
+
+    def _append(self, text):
+        with open(self.filename, 'a') as f:
+            f.write(text)
+
+    def _lines(self):
+        return Reader._FollowLines(self.filename, 0.001, 0.01)
+
+    def test_incremental_lines(self):
+        self._append('first\nsec')
+        lines = self._lines()
+        self.assertEqual(next(lines), 'first')
+        self._append('ond\r\nthird\n')
+        self.assertEqual(next(lines), 'second')
+        self.assertEqual(next(lines), 'third')
+        self._append('last')
+        self.assertEqual(list(lines), ['last'])
+
+    def test_rows(self):
+        text = open(_standard).read()
+        split = text.index('\n', text.index('"Q2"')) + 5  # inside the line after the Q2 header
+        self._append(text[:split])
+        rows = self.reader.FollowOptics(self.filename, interval=0.001, timeout=0.01)
+        first = [next(rows) for _ in range(2)]  # BEAM and ACC0, A1 is complete but not an optics row
+        self._append(text[split:])
+        followed = first + list(rows)
+        optics = self.reader.GetOptics(_standard)
+        self.assertEqual(len(followed), len(optics))
+        for i, row in enumerate(followed):
+            self.assertEqual(repr(tuple(row[name] for name in optics.names)), repr(optics.GetItemTuple(i)))
+
+    def test_callback(self):
+        shutil.copy(_standard, self.filename)
+        rows = []
+        self.assertIsNone(self.reader.FollowOptics(self.filename, rows.append, interval=0.001, timeout=0.01))
+        self.assertEqual([row['Name'] for row in rows], list(self.reader.GetOptics(_standard).Name()))
+
+    def test_truncated(self):
+        self._append('first\nsecond\n')
+        lines = self._lines()
+        self.assertEqual(next(lines), 'first')
+        with open(self.filename, 'w') as f:
+            f.write('x\n')
+        self.assertEqual(next(lines), 'second')
+        with self.assertRaises(IOError) as raised:
+            next(lines)
+        self.assertIn('was truncated while being followed', str(raised.exception))
+
+    def test_replaced(self):
+        self._append('first\n')
+        lines = self._lines()
+        self.assertEqual(next(lines), 'first')
+        other = self._write('other.dat', ['first', 'second', 'third', ''])
+        os.rename(other, self.filename)
+        with self.assertRaises(IOError) as raised:
+            next(lines)
+        self.assertIn('was replaced while being followed', str(raised.exception))
+
+
+class TestOpticsMany(_TempDirTest):
+    def test_errors_per_file(self):
+        missing = os.path.join(self.directory, 'missing.dat')
+        unknown = self._write('unknown.dat', ['not an output file'])
+        for workers in (1, 2):
+            optics, errors = self.reader.GetOpticsMany([_standard, missing, unknown, _singleLine], workers=workers)
+            self.assertEqual(sorted(errors), sorted([missing, unknown]))
+            self.assertTrue(errors[missing].startswith('IOError'))
+            self.assertIsNone(optics[1])
+            self.assertIsNone(optics[2])
+            for data, filename in [(optics[0], _standard), (optics[3], _singleLine)]:
+                self.assertEqual(list(data), list(self.reader.GetOptics(filename)))
+
+    def test_mixed_types(self):
+        optics, errors = self.reader.GetOpticsMany([_standard, _beam], workers=1)
+        self.assertEqual(errors, {})
+        self.assertNotEqual(sorted(optics[0].names), sorted(optics[1].names))
+        self.assertRaises(ValueError, self.reader.GetOpticsMany, [_standard, _beam], workers=1, stack=True)
+
+    def test_stack(self):
+        missing = os.path.join(self.directory, 'missing.dat')
+        for columnar in (False, True):
+            stacked, errors = self.reader.GetOpticsMany([_standard, missing, _standard], workers=1,
+                                                        columnar=columnar, stack=True)
+            optics = self.reader.GetOptics(_standard)
+            self.assertEqual(sorted(stacked), sorted(optics.names))
+            self.assertEqual(stacked['S'].shape, (3, len(optics)))
+            self.assertEqual(stacked['S'][2].tolist(), optics.GetColumn('S').tolist())
+            self.assertTrue(np.isnan(stacked['S'][1]).all())
+            self.assertEqual(stacked['Name'][1].tolist(), [''] * len(optics))
+
+    def test_stack_mixed_outputs(self):
+        optics = self.reader.GetOptics(_standard)
+        columns = self.reader.GetOptics(_standard, columnar=True)
+        stacked = Reader._StackOptics([optics, None, columns])
+        self.assertEqual(stacked['Beta_x'][0].tolist(), stacked['Beta_x'][2].tolist())
+        self.assertEqual(stacked['Name'][2].tolist(), optics.GetColumn('Name').tolist())
+
+    def test_stack_mismatched_columns(self):
+        columns = self.reader.GetOptics(_standard, columnar=True)
+        fewer = columns[[name for name in columns.dtype.names if name != 'E']]
+        self.assertRaises(ValueError, Reader._StackOptics, [columns, fewer])
+        self.assertRaises(ValueError, Reader._StackOptics, [fewer, columns])
+        self.assertRaises(ValueError, Reader._StackOptics, [columns, columns[1:]])
+
+
+class TestBeamErrors(_TempDirTest):
+    def setUp(self):
+        _TempDirTest.setUp(self)
+        self.stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        _TempDirTest.tearDown(self)
+
+    def test_errors(self):
+        expected = ['Could not process section beginning at line 184']
+        self.assertEqual(self.reader.GetOptics(_beam).errors, expected)
+        self.assertEqual(self.reader.GetOpticsAt(_beam, ['Q14'], last=True).errors, [])
+        self.assertEqual(self.reader.GetOpticsAt(_beam, ['X']).errors, expected)
+        cached = Reader.Reader(cache=OutputCache(os.path.join(self.directory, 'cache')))
+        cached.GetOptics(_beam)
+        self.assertEqual(cached.GetOptics(_beam).errors, expected)
+        self.assertEqual(sys.stdout.getvalue(), '')
+
+
+class TestCache(_TempDirTest):
+    def test_missing_file(self):
+        filename = os.path.join(self.directory, 'missing.dat')
+        cached = Reader.Reader(cache=OutputCache(os.path.join(self.directory, 'cache')))
+        for reader in (self.reader, cached):
+            with self.assertRaises(IOError) as raised:
+                reader.GetOptics(filename)
+            self.assertEqual(raised.exception.filename, filename)
+
+
+if __name__ == '__main__':
+    unittest.main()